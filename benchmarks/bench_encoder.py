@@ -0,0 +1,93 @@
+"""
+Micro-benchmark of the encoder of web service arguments.
+
+Compares MoodleTool._urlencode_dict with the previous recursive implementation on deep and wide
+argument shapes and checks that both produce identical output.
+
+Usage: python benchmarks/bench_encoder.py
+"""
+
+import asyncio
+import time
+from typing import Any, Callable, Dict, List
+from urllib.parse import urlencode
+from moodle_mcp_server.tools import MoodleTool
+
+
+def urlencode_dict(d: Dict[str, Any]) -> str:
+    """Previous implementation, kept here for comparison."""
+    def _flatten(list_of_dicts: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {key: val for k in list_of_dicts for key, val in k.items()}
+
+    def _append_prefix(arg: Any, prefix: str) -> Dict[str, Any]:
+        if isinstance(arg, list):
+            return _flatten([_append_prefix(value, f"{prefix}[{index}]") for index, value in enumerate(arg)])
+        elif isinstance(arg, dict):
+            return _flatten([_append_prefix(value, f"{prefix}[{index}]") for index, value in arg.items()])
+        elif arg is None:
+            return {prefix: ""}
+        else:
+            return {prefix: arg}
+
+    return urlencode(_flatten([_append_prefix(value, index) for index, value in d.items()]), safe='[]')
+
+
+def create_users(count: int) -> Dict[str, Any]:
+    """Wide: core_user_create_users with many users."""
+    return {"users": [{
+        "username": f"user{i}", "password": "Pa$$w0rd!", "firstname": "First", "lastname": f"Läst {i}",
+        "email": f"user{i}@example.com", "auth": "manual", "city": "Perth", "country": "AU", "description": None,
+        "customfields": [{"type": "department", "value": "R&D"}],
+        "preferences": [{"type": "auth_forcepasswordchange", "value": 1}],
+    } for i in range(count)]}
+
+
+def update_grades(count: int) -> Dict[str, Any]:
+    """Wide and flat: core_grades_update_grades bulk update."""
+    return {"source": "mod/assign", "courseid": 2, "component": "mod_assign", "activityid": 5, "itemnumber": 0,
+            "grades": [{"studentid": i, "grade": i % 100 + 0.5, "str_feedback": "Well done"} for i in range(count)],
+            "itemdetails": {"itemname": "Assignment", "hidden": False}}
+
+
+def deep(depth: int, width: int) -> Dict[str, Any]:
+    """Deep: nested structures."""
+    node: Any = {f"leaf{i}": i for i in range(width)}
+    for level in range(depth):
+        node = {"level": level, "children": [node] * width}
+    return {"options": node}
+
+
+def measure(label: str, fn: Callable[[], Any], repeat: int = 5) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"    {label:<20} {best * 1000:9.1f} ms")
+    return best
+
+
+async def stream(data: Dict[str, Any]) -> bytes:
+    return b"".join([chunk async for chunk in MoodleTool._stream_urlencoded(data)])
+
+
+def main() -> None:
+    shapes = {
+        "create_users x 5000": create_users(5000),
+        "update_grades x 20000": update_grades(20000),
+        "deep 6 x 4": deep(6, 4),
+    }
+    for label, data in shapes.items():
+        expected = urlencode_dict(data)
+        assert MoodleTool._urlencode_dict(data) == expected, f"{label}: different output"
+        assert asyncio.run(stream(data)) == expected.encode(), f"{label}: different streamed output"
+        print(f"{label} ({len(expected)} bytes):")
+        old = measure("recursive", lambda: urlencode_dict(data))
+        new = measure("iterative", lambda: MoodleTool._urlencode_dict(data))
+        measure("iterative, streamed", lambda: asyncio.run(stream(data)))
+        print(f"    speedup: {old / new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
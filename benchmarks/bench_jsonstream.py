@@ -0,0 +1,105 @@
+"""
+Benchmark of parsing a large web service response.
+
+Compares reading the whole body with httpx and calling response.json() with the incremental parser
+(JsonStream.parse, requires the optional 'ijson' package) when only some fields are requested.
+Reports time and peak memory allocated by Python (tracemalloc) and checks that the results are identical,
+for a response that is a top-level array and for one wrapped in an object, like most Moodle responses.
+
+Usage: python benchmarks/bench_jsonstream.py [number of users]
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import httpx
+
+os.environ.setdefault("MOODLE_STREAM_PARSE_MIN_BYTES", "0")
+
+from moodle_mcp_server.jsonstream import JsonStream
+from moodle_mcp_server.projection import ResultProjection
+
+
+def enrolled_users(count: int) -> List[Dict[str, Any]]:
+    """Response of core_enrol_get_enrolled_users."""
+    return [{
+        "id": i,
+        "username": f"user{i}",
+        "fullname": f"User Number {i}",
+        "email": f"user{i}@example.com",
+        "description": "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 4,
+        "firstaccess": 1700000000 + i,
+        "lastaccess": 1710000000 + i,
+        "customfields": [{"type": "text", "value": f"value {i}", "name": "Field", "shortname": "field"}],
+        "groups": [{"id": 1, "name": "Group A", "description": "", "descriptionformat": 1}],
+        "roles": [{"roleid": 5, "name": "", "shortname": "student", "sortorder": 0}],
+        "enrolledcourses": [{"id": c, "fullname": f"Course {c}", "shortname": f"C{c}"} for c in range(5)],
+    } for i in range(count)]
+
+
+def response(body: bytes) -> httpx.Response:
+    async def chunks():
+        for start in range(0, len(body), 65536):
+            yield body[start:start + 65536]
+    return httpx.Response(200, stream=_Stream(chunks()))
+
+
+class _Stream(httpx.AsyncByteStream):
+    def __init__(self, chunks) -> None:
+        self._chunks = chunks
+
+    async def __aiter__(self):
+        async for chunk in self._chunks:
+            yield chunk
+
+
+async def buffered(body: bytes) -> Any:
+    result = response(body)
+    await result.aread()
+    return result.json()
+
+
+def measure(label: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+    # Time and memory are measured in separate runs, tracing of allocations slows down the parsing.
+    start = time.perf_counter()
+    asyncio.run(fn())
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    result = asyncio.run(fn())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"    {label:<28} {elapsed * 1000:9.1f} ms   peak {peak / 1024 / 1024:8.1f} MB")
+    return result
+
+
+def main() -> None:
+    if not JsonStream.available():
+        print("Install the optional 'ijson' package to run this benchmark.")
+        return
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    users = enrolled_users(count)
+    run(f"core_enrol_get_enrolled_users x {count}", json.dumps(users).encode(),
+        ["id", "fullname", "roles.shortname"])
+    run(f"{{\"users\": [...], \"warnings\": []}} x {count}", json.dumps({"users": users, "warnings": []}).encode(),
+        ["users.id", "users.fullname", "users.roles.shortname", "warnings"])
+
+
+def run(label: str, body: bytes, fields: List[str]) -> None:
+    tree: Optional[Dict[str, Any]] = ResultProjection.compile_fields(fields)
+    print(f"{label} ({len(body) / 1024 / 1024:.1f} MB):")
+    measure("buffered json()", lambda: buffered(body))
+    projected = measure("buffered json() + projection", lambda: _project(buffered(body), tree))
+    streamed = measure("streamed with projection", lambda: JsonStream.parse(response(body), tree))
+    assert streamed == projected, "different projected result"
+
+
+async def _project(result: Awaitable[Any], tree: Optional[Dict[str, Any]]) -> Any:
+    return ResultProjection.project(await result, tree)
+
+
+if __name__ == "__main__":
+    main()
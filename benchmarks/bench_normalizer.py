@@ -0,0 +1,108 @@
+"""
+Benchmark of the output normalizer on large synthetic payloads.
+
+Compares the compiled SchemaNormalizer with the previous recursive implementation
+of MoodleTool._fix_empty_arrays.
+
+Usage: python benchmarks/bench_normalizer.py [number of users]
+"""
+
+import copy
+import sys
+import time
+from typing import Any
+from moodle_mcp_server.normalizer import SchemaNormalizer
+
+
+def fix_empty_arrays(result: Any, schema: Any) -> Any:
+    """Previous implementation, kept here for comparison."""
+    if schema is None or not isinstance(schema, dict) or schema.get("type", None) is None:
+        return result
+    if schema["type"] == "object" and isinstance(result, list) and len(result) == 0:
+        return {}
+    if schema["type"] == "array" and isinstance(result, list) and schema.get("items", None) is not None:
+        return [fix_empty_arrays(item, schema["items"]) for item in result]
+    if schema["type"] == "object" and isinstance(result, dict) and isinstance(schema.get("properties", None), dict):
+        return {k: fix_empty_arrays(v, schema["properties"].get(k, None)) for k, v in result.items()}
+    return result
+
+
+def scalar(type_: str) -> dict:
+    return {"type": type_}
+
+
+def enrolled_users_schema() -> dict:
+    """Output schema similar to core_enrol_get_enrolled_users."""
+    user = {
+        "type": "object",
+        "properties": {
+            **{name: scalar("string") for name in ("username", "firstname", "lastname", "fullname", "email",
+                                                   "address", "phone1", "department", "institution", "city",
+                                                   "country", "description", "profileimageurl")},
+            **{name: scalar("integer") for name in ("id", "firstaccess", "lastaccess", "lastcourseaccess")},
+            "customfields": {"type": "array", "items": {"type": "object", "properties": {
+                "type": scalar("string"), "value": scalar("string"), "name": scalar("string"), "shortname": scalar("string")}}},
+            "groups": {"type": "array", "items": {"type": "object", "properties": {
+                "id": scalar("integer"), "name": scalar("string"), "description": scalar("string")}}},
+            "roles": {"type": "array", "items": {"type": "object", "properties": {
+                "roleid": scalar("integer"), "name": scalar("string"), "shortname": scalar("string")}}},
+            "preferences": {"type": "array", "items": {"type": "object", "properties": {
+                "name": scalar("string"), "value": scalar("string")}}},
+            "enrolledcourses": {"type": "array", "items": {"type": "object", "properties": {
+                "id": scalar("integer"), "fullname": scalar("string"), "shortname": scalar("string")}}},
+            "extra": {"type": "object", "properties": {"a": scalar("string")}},
+        },
+    }
+    return {"type": "object", "properties": {"result": {"type": "array", "items": user}}}
+
+
+def enrolled_users_payload(count: int) -> dict:
+    users = []
+    for i in range(count):
+        users.append({
+            "id": i, "username": f"user{i}", "firstname": "First", "lastname": f"Last{i}", "fullname": f"First Last{i}",
+            "email": f"user{i}@example.com", "address": "", "phone1": "", "department": "", "institution": "",
+            "city": "Perth", "country": "AU", "description": "<p>Hello</p>", "profileimageurl": "https://example.com/u.png",
+            "firstaccess": 1700000000, "lastaccess": 1700000000 + i, "lastcourseaccess": 1700000000,
+            "customfields": [{"type": "text", "value": "x", "name": "Field", "shortname": "field"}],
+            "groups": [{"id": 1, "name": "Group", "description": ""}] if i % 3 else [],
+            "roles": [{"roleid": 5, "name": "", "shortname": "student"}],
+            "preferences": [{"name": f"pref{j}", "value": "1"} for j in range(5)],
+            "enrolledcourses": [{"id": j, "fullname": f"Course {j}", "shortname": f"C{j}"} for j in range(3)],
+            "extra": [],
+        })
+    return {"result": users}
+
+
+def measure(label: str, fn, payload: dict, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        data = copy.deepcopy(payload)
+        start = time.perf_counter()
+        fn(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"  {label:<28} {best * 1000:9.1f} ms")
+    return best
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    schema = enrolled_users_schema()
+    payload = enrolled_users_payload(count)
+
+    start = time.perf_counter()
+    normalizer = SchemaNormalizer.compile(schema)
+    print(f"Compiling the schema took {(time.perf_counter() - start) * 1000:.2f} ms")
+
+    expected = fix_empty_arrays(copy.deepcopy(payload), schema)
+    assert normalizer(copy.deepcopy(payload)) == expected, "Normalizers produced different results"
+
+    print(f"Normalizing {count} users:")
+    old = measure("recursive _fix_empty_arrays", lambda data: fix_empty_arrays(data, schema), payload, 5)
+    new = measure("compiled SchemaNormalizer", normalizer, payload, 5)
+    print(f"  speedup: {old / new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
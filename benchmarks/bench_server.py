@@ -0,0 +1,124 @@
+"""
+End-to-end benchmark of the server against a local mock Moodle site (benchmarks/mock_moodle.py), without network access.
+
+The mock site and the lookup service run in a separate process with the configured latency and response sizes.
+MoodleMiddleware is driven through an in-process FastMCP client; for tools/list, a function call, upload_files and
+download_file the given number of requests is sent with the given concurrency, and the throughput and p50/p99
+latency are reported.
+
+Usage: python benchmarks/bench_server.py [--requests 200] [--concurrency 10] [--latency 20] [--items 50] ...
+(see --help for all options)
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Awaitable, Callable, List
+import httpx
+
+import mock_moodle
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_mock(args: argparse.Namespace, port: int) -> subprocess.Popen:
+    """Start the mock site and wait until it accepts connections."""
+    command = [sys.executable, mock_moodle.__file__, "--port", str(port),
+               "--latency", str(args.latency), "--lookup-latency", str(args.lookup_latency),
+               "--functions", str(args.functions), "--items", str(args.items),
+               "--item-bytes", str(args.item_bytes), "--file-bytes", str(args.file_bytes)]
+    if args.no_wsdiscovery:
+        command.append("--no-wsdiscovery")
+    process = subprocess.Popen(command)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            httpx.post(f"http://127.0.0.1:{port}/lookup", json={"functions": []}, timeout=1)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("The mock Moodle site did not start")
+
+
+async def measure(label: str, requests: int, concurrency: int, operation: Callable[[int], Awaitable[Any]]) -> None:
+    """Send the requests from concurrent workers and print the throughput and latency percentiles."""
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker() -> None:
+        nonlocal errors
+        for index in counter:
+            start = time.perf_counter()
+            try:
+                await operation(index)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{label:<14} {requests / elapsed:9.1f} req/s   p50 {p50 * 1000:8.1f} ms   p99 {p99 * 1000:8.1f} ms"
+          + (f"   errors {errors}" if errors else ""))
+
+
+async def run(args: argparse.Namespace, baseurl: str) -> None:
+    from fastmcp import Client, FastMCP
+    from moodle_mcp_server.middleware import MoodleMiddleware
+
+    mcp = FastMCP("benchmark", middleware=[MoodleMiddleware()])
+    upload_content = "x" * args.upload_bytes
+    fileurl = f"{baseurl}/pluginfile.php/5/user/draft/1/benchmark.bin"
+
+    async with Client(mcp) as session:
+        start = time.perf_counter()
+        tools = await session.list_tools()
+        print(f"first tools/list ({len(tools)} tools): {(time.perf_counter() - start) * 1000:.1f} ms")
+        functions = [tool.name for tool in tools if tool.name.startswith(mock_moodle.FUNCTION_PREFIX)]
+        print(f"{args.requests} requests, concurrency {args.concurrency}, Moodle latency {args.latency:g} ms")
+
+        await measure("list_tools", args.requests, args.concurrency, lambda i: session.list_tools())
+        await measure("call_tool", args.requests, args.concurrency,
+                      lambda i: session.call_tool(functions[i % len(functions)], {"courseid": i}))
+        await measure("upload_files", args.requests, args.concurrency,
+                      lambda i: session.call_tool("upload_files", {"itemid": 0, "files": [
+                          {"filename": f"file{i}.txt", "uploadtype": "plaintext", "content": upload_content}]}))
+        await measure("download_file", args.requests, args.concurrency,
+                      lambda i: session.call_tool("download_file", {"url": fileurl}))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the server against a local mock Moodle site")
+    parser.add_argument("--requests", type=int, default=200, help="number of requests per operation")
+    parser.add_argument("--concurrency", type=int, default=10, help="number of requests sent at the same time")
+    parser.add_argument("--upload-bytes", type=int, default=64 * 1024, help="size of the uploaded file")
+    mock_moodle.add_arguments(parser)
+    args = parser.parse_args()
+
+    port = free_port()
+    baseurl = f"http://127.0.0.1:{port}"
+    os.environ.update({"MOODLE": baseurl, "TOKEN": "benchmark", "MOODLE_LOOKUP_URL": f"{baseurl}/lookup",
+                       "MOODLE_SCHEMA_CACHE": "0"})
+    process = start_mock(args, port)
+    try:
+        asyncio.run(run(args, baseurl))
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Startup benchmark: time to import the server, to the first tools/list and the first tools/call
+with a catalog of several hundred functions, and the time of the following tools/list requests.
+
+Moodle and the lookup service are replaced by in-process handlers, so only the server itself is measured.
+
+Usage: python benchmarks/bench_startup.py [number of functions]
+"""
+
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+os.environ.setdefault("MOODLE", "https://moodle.example.com")
+os.environ.setdefault("TOKEN", "benchmark")
+os.environ.setdefault("MOODLE_SCHEMA_CACHE", "0")
+
+
+def function_definition(index: int) -> Dict[str, Any]:
+    """Definition of a function as returned by the lookup service, with a typical nested output schema."""
+    item = {
+        "type": "object",
+        "properties": {
+            "id": {"type": "integer", "description": "Id"},
+            "name": {"type": "string", "description": "Name"},
+            "visible": {"type": "integer", "description": "Visibility"},
+            "summary": {"type": "string", "description": "Summary"},
+            "modules": {"type": "array", "items": {"type": "object", "properties": {
+                "id": {"type": "integer"}, "name": {"type": "string"}, "url": {"type": "string"},
+                "contents": {"type": "array", "items": {"type": "object", "properties": {
+                    "filename": {"type": "string"}, "filesize": {"type": "integer"}, "fileurl": {"type": "string"},
+                }}},
+            }, "required": ["id", "name"]}},
+        },
+        "required": ["id", "name"],
+    }
+    return {
+        "name": f"local_benchmark_get_items_{index}",
+        "description": f"Returns items of kind {index}",
+        "inputSchema": {"type": "object", "properties": {
+            "courseid": {"type": "integer", "description": "Course id"},
+            "options": {"type": "array", "items": {"type": "object", "properties": {
+                "name": {"type": "string"}, "value": {"type": "string"}}}},
+        }, "required": ["courseid"]},
+        "outputSchema": {"type": "object", "properties": {"result": {"type": "array", "items": item}}, "required": ["result"]},
+    }
+
+
+def import_time() -> float:
+    """Import of the server module in a fresh interpreter."""
+    code = "import time; s = time.perf_counter(); import moodle_mcp_server.main; print(time.perf_counter() - s)"
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+async def run(count: int) -> None:
+    import httpx
+    from fastmcp import Client, FastMCP
+    from moodle_mcp_server.catalog import CatalogEntry
+    from moodle_mcp_server.middleware import MoodleMiddleware
+    from moodle_mcp_server.transport import HttpTransport
+
+    functions: List[Dict[str, Any]] = [function_definition(i) for i in range(count)]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json=[{"id": 1, "name": "Item", "modules": []}])
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    HttpTransport.get_client = staticmethod(lambda url: client)
+
+    middleware = MoodleMiddleware()
+
+    async def load_catalog(ctx: Any, previous: Any = None) -> CatalogEntry:
+        return CatalogEntry([dict(f) for f in functions])
+
+    middleware._load_catalog = load_catalog
+    mcp = FastMCP("benchmark", middleware=[middleware])
+
+    async with Client(mcp) as session:
+        start = time.perf_counter()
+        tools = await session.list_tools()
+        first_list = time.perf_counter() - start
+        start = time.perf_counter()
+        await session.call_tool(tools[0].name, {"courseid": 1})
+        first_call = time.perf_counter() - start
+
+        timings = []
+        for _ in range(20):
+            start = time.perf_counter()
+            await session.list_tools()
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+
+    print(f"first tools/list ({len(tools)} tools): {first_list * 1000:8.1f} ms")
+    print(f"first tools/call:                {first_call * 1000:8.1f} ms")
+    print(f"warm tools/list (median of 20):  {timings[len(timings) // 2] * 1000:8.1f} ms")
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 700
+    print(f"import moodle_mcp_server.main:   {import_time() * 1000:8.1f} ms")
+    asyncio.run(run(count))
+
+
+if __name__ == "__main__":
+    main()
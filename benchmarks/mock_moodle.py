@@ -0,0 +1,189 @@
+"""
+Local stand-in for a Moodle site and the MCP Ready lookup service, used by the benchmarks.
+
+Serves webservice/rest/server.php, webservice/upload.php, webservice/pluginfile.php, admin/tool/wsdiscovery/moodle.php
+and the lookup endpoint (/lookup) with a configurable latency and size of the responses. Any token is accepted.
+
+Usage: python benchmarks/mock_moodle.py [--port 8100] [--latency 20] [--functions 200] [--items 50] ...
+Then start the server with MOODLE=http://127.0.0.1:8100 MOODLE_LOOKUP_URL=http://127.0.0.1:8100/lookup.
+"""
+
+import argparse
+import asyncio
+import re
+from typing import Any, Dict, List
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+FUNCTION_PREFIX = "local_benchmark_get_items_"
+
+
+def function_definition(name: str) -> Dict[str, Any]:
+    """Definition of a function as returned by the lookup service."""
+    item = {
+        "type": "object",
+        "properties": {
+            "id": {"type": "integer", "description": "Id"},
+            "name": {"type": "string", "description": "Name"},
+            "summary": {"type": "string", "description": "Summary"},
+            "modules": {"type": "array", "items": {"type": "object", "properties": {
+                "id": {"type": "integer"}, "name": {"type": "string"}, "url": {"type": "string"},
+            }}},
+        },
+        "required": ["id", "name"],
+    }
+    return {
+        "name": name,
+        "description": f"Returns items ({name})",
+        "inputSchema": {"type": "object", "properties": {
+            "courseid": {"type": "integer", "description": "Course id"},
+        }, "required": ["courseid"]},
+        "outputSchema": {"type": "object", "properties": {"result": {"type": "array", "items": item}}, "required": ["result"]},
+    }
+
+
+# Helper tools that the lookup service adds to its response.
+EXTRA_TOOLS: List[Dict[str, Any]] = [
+    {
+        "name": "upload_files",
+        "description": "Uploads files to the draft file area",
+        "inputSchema": {"type": "object", "properties": {
+            "itemid": {"type": "integer"},
+            "filepath": {"type": "string"},
+            "files": {"type": "array", "items": {"type": "object", "properties": {
+                "filename": {"type": "string"}, "uploadtype": {"type": "string"}, "content": {"type": "string"},
+            }, "required": ["filename", "content"]}},
+        }, "required": ["files"]},
+    },
+    {
+        "name": "download_file",
+        "description": "Downloads a file given its pluginfile.php URL",
+        "inputSchema": {"type": "object", "properties": {"url": {"type": "string"}}, "required": ["url"]},
+    },
+]
+
+
+class MockMoodle:
+    """Responses of the mock site. Latencies are in seconds, sizes in bytes."""
+
+    def __init__(self, functions: int = 200, items: int = 50, item_bytes: int = 200, file_bytes: int = 1024 * 1024,
+                 latency: float = 0.02, lookup_latency: float = 0.05, wsdiscovery: bool = True) -> None:
+        self.functions = [f"{FUNCTION_PREFIX}{i}" for i in range(functions)]
+        self.items = items
+        self.item_bytes = item_bytes
+        self.file = bytes(i % 251 for i in range(file_bytes))
+        self.latency = latency
+        self.lookup_latency = lookup_latency
+        self.wsdiscovery = wsdiscovery
+        self.itemid = 0
+
+
+    def result(self) -> List[Dict[str, Any]]:
+        summary = "x" * max(0, self.item_bytes - 120)
+        return [{"id": i, "name": f"Item {i}", "summary": summary,
+                 "modules": [{"id": i * 10 + m, "name": f"Module {m}", "url": f"https://example.com/mod/{m}"} for m in range(2)]}
+                for i in range(self.items)]
+
+
+    async def rest(self, request: Request) -> Response:
+        await asyncio.sleep(self.latency)
+        form = await request.form()
+        name = str(form.get("wsfunction") or request.query_params.get("wsfunction", ""))
+        if name == "core_webservice_get_site_info":
+            return JSONResponse({"sitename": "Benchmark", "release": "4.5", "version": "2024100700",
+                                 "functions": [{"name": f, "version": "2024100700"} for f in self.functions]})
+        if name in self.functions:
+            return JSONResponse(self.result())
+        return JSONResponse({"exception": "dml_missing_record_exception", "errorcode": "invalidrecord",
+                             "message": f"Can't find data record in database table external_functions ({name})."})
+
+
+    async def wsdiscovery_structure(self, request: Request) -> Response:
+        await asyncio.sleep(self.latency)
+        if not self.wsdiscovery:
+            return Response("Not found", status_code=404)
+        return JSONResponse({"functions": [{"name": f} for f in self.functions]})
+
+
+    async def lookup(self, request: Request) -> Response:
+        await asyncio.sleep(self.lookup_latency)
+        payload = await request.json()
+        items = next(iter(payload.values()), [])
+        names = [item.get("name") if isinstance(item, dict) else item for item in items]
+        return JSONResponse({"functions": [function_definition(n) for n in names if n in self.functions] + EXTRA_TOOLS})
+
+
+    async def upload(self, request: Request) -> Response:
+        await asyncio.sleep(self.latency)
+        form = await request.form()
+        itemid = int(form.get("itemid") or 0)
+        if not itemid:
+            self.itemid += 1
+            itemid = self.itemid
+        filepath = str(form.get("filepath") or "/")
+        uploaded = []
+        for _, value in form.multi_items():
+            if hasattr(value, "read"):
+                content = await value.read()
+                uploaded.append({"component": "user", "contextid": 5, "userid": "2", "filearea": "draft",
+                                 "filename": value.filename, "filepath": filepath, "itemid": itemid,
+                                 "license": "unknown", "author": "Admin User", "source": "", "filesize": len(content)})
+        return JSONResponse(uploaded)
+
+
+    async def pluginfile(self, request: Request) -> Response:
+        await asyncio.sleep(self.latency)
+        filename = request.url.path.rsplit("/", 1)[-1] or "file.bin"
+        headers = {"Content-Disposition": f'inline; filename="{filename}"', "Accept-Ranges": "bytes"}
+        data, status = self.file, 200
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", request.headers.get("range", ""))
+        if match and int(match.group(1)) < len(self.file):
+            start = int(match.group(1))
+            end = min(int(match.group(2)) if match.group(2) else len(self.file) - 1, len(self.file) - 1)
+            data, status = self.file[start:end + 1], 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(self.file)}"
+        if request.method == "HEAD":
+            headers["Content-Length"] = str(len(data))
+            data = b""
+        return Response(data, status_code=status, headers=headers, media_type="application/octet-stream")
+
+
+    def app(self) -> Starlette:
+        return Starlette(routes=[
+            Route("/webservice/rest/server.php", self.rest, methods=["GET", "POST"]),
+            Route("/webservice/upload.php", self.upload, methods=["POST"]),
+            Route("/webservice/pluginfile.php/{path:path}", self.pluginfile, methods=["GET", "POST", "HEAD"]),
+            Route("/admin/tool/wsdiscovery/moodle.php", self.wsdiscovery_structure, methods=["GET", "POST"]),
+            Route("/lookup", self.lookup, methods=["POST"]),
+        ])
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency", type=float, default=20, help="latency of every Moodle request (ms)")
+    parser.add_argument("--lookup-latency", type=float, default=50, help="latency of the lookup service (ms)")
+    parser.add_argument("--functions", type=int, default=200, help="number of functions on the site")
+    parser.add_argument("--items", type=int, default=50, help="number of elements in the result of a function")
+    parser.add_argument("--item-bytes", type=int, default=200, help="approximate size of one element (bytes)")
+    parser.add_argument("--file-bytes", type=int, default=1024 * 1024, help="size of the file served by pluginfile.php")
+    parser.add_argument("--no-wsdiscovery", action="store_true", help="answer 404 to tool_wsdiscovery, as a site without the plugin")
+
+
+def from_arguments(args: argparse.Namespace) -> MockMoodle:
+    return MockMoodle(functions=args.functions, items=args.items, item_bytes=args.item_bytes, file_bytes=args.file_bytes,
+                      latency=args.latency / 1000, lookup_latency=args.lookup_latency / 1000, wsdiscovery=not args.no_wsdiscovery)
+
+
+def main() -> None:
+    import uvicorn
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(from_arguments(args).app(), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
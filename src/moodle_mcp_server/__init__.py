@@ -7,10 +7,24 @@ try:
 except Exception:
     __version__ = "0.0.0"  # Fallback for development
 
-from .main import main
-from .middleware import MoodleMiddleware
-from .models import DownloadedFile
-from .tools import MoodleTool
-from .utils import Utils
+# The public names are imported on first use, so that importing a submodule (or the package for its version)
+# does not import fastmcp and create the server.
+_exports = {
+    "main": ".main",
+    "MoodleMiddleware": ".middleware",
+    "MoodleTool": ".tools",
+    "DownloadedFile": ".models",
+    "HttpTransport": ".transport",
+    "Utils": ".utils",
+}
 
-__all__ = ["main", "MoodleMiddleware", "MoodleTool", "DownloadedFile", "Utils"]
+__all__ = ["main", "MoodleMiddleware", "MoodleTool", "DownloadedFile", "HttpTransport", "Utils"]
+
+
+def __getattr__(name: str):
+    if name in _exports:
+        from importlib import import_module
+        value = getattr(import_module(_exports[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,99 @@
+import asyncio
+import hashlib
+import json
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+
+SiteKey = Tuple[str, str]
+
+
+class CatalogEntry:
+    """
+    Function definitions loaded for one site, together with the time they were loaded.
+
+    The entry also remembers the digest of the function list reported by the site (listing), the fingerprint
+    of every function in it, so that the next refresh can tell which functions were added or changed, and the names
+    of the helper tools added by the lookup service (not in the listing of the site).
+    """
+
+    def __init__(self, functions: List[Dict[str, Any]], listing: Optional[str] = None,
+                 fingerprints: Optional[Dict[str, str]] = None, digest: Optional[str] = None,
+                 extras: Optional[Set[str]] = None) -> None:
+        self.functions = functions
+        self.digest = digest or CatalogEntry.compute_digest(functions)
+        self.listing = listing
+        self.fingerprints: Dict[str, str] = fingerprints or {}
+        self.extras: Set[str] = extras or set()
+        self.loaded_at = time.monotonic()
+        self.refresh_task: Optional[asyncio.Task] = None
+
+
+    @staticmethod
+    def compute_digest(functions: List[Dict[str, Any]]) -> str:
+        """Digest of the function definitions, used to detect if the catalog actually changed on refresh."""
+        return hashlib.sha256(json.dumps(functions, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class ToolCatalogCache:
+    """
+    Cache of function definitions per site, keyed by (site URL, token fingerprint).
+
+    Entries older than the TTL are still served, the caller is expected to refresh them in the
+    background (stale-while-revalidate). TTL of zero disables caching.
+    """
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self._entries: Dict[SiteKey, CatalogEntry] = {}
+        self.hits = 0
+        self.misses = 0
+        self.changes = 0
+        self.unchanged = 0
+
+
+    def get(self, key: SiteKey) -> Optional[CatalogEntry]:
+        """Return the cached entry for the site, stale or not, or None if nothing is cached."""
+        entry = self._entries.get(key) if self.ttl > 0 else None
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+
+    def is_stale(self, entry: CatalogEntry) -> bool:
+        return time.monotonic() - entry.loaded_at >= self.ttl
+
+
+    def peek(self, key: SiteKey) -> Optional[CatalogEntry]:
+        """Return the cached entry without counting a hit or a miss."""
+        return self._entries.get(key)
+
+
+    def put(self, key: SiteKey, entry: CatalogEntry) -> Tuple[CatalogEntry, bool]:
+        """
+        Store freshly loaded function definitions. Returns the cached entry and True if the definitions differ from the
+        previously cached ones. If they are the same, the previous entry is kept and only its TTL restarts.
+        """
+        previous = self._entries.get(key)
+        if previous is not None and previous.digest == entry.digest:
+            previous.listing, previous.fingerprints, previous.extras = entry.listing, entry.fingerprints, entry.extras
+            previous.loaded_at = entry.loaded_at
+            previous.refresh_task = None
+            self.unchanged += 1
+            return previous, False
+        if previous is not None:
+            self.changes += 1
+        if self.ttl > 0:
+            self._entries[key] = entry
+        return entry, previous is not None
+
+
+    def invalidate(self, key: SiteKey) -> None:
+        self._entries.pop(key, None)
+
+
+    def stats(self) -> Dict[str, Any]:
+        return {"sites": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "changes": self.changes, "unchanged": self.unchanged}
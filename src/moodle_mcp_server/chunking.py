@@ -0,0 +1,145 @@
+import asyncio
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from fastmcp.exceptions import ToolError
+from fastmcp.tools.tool import ToolResult
+from mcp.types import TextContent
+from .normalizer import Normalizer
+from .projection import ResultProjection
+from .settings import Settings
+from .tools import MoodleTool
+
+
+class BulkChunker:
+    """
+    Splits calls to bulk write functions into several smaller concurrent requests.
+
+    Moodle sites limit the number of request fields (PHP max_input_vars) and the execution time of a request,
+    so one call with thousands of users or enrolments is either slow or rejected. Functions that write data and
+    take one top-level array of objects (core_user_create_users, enrol_manual_enrol_users, core_cohort_add_cohort_members,
+    etc.) are detected from their input schema, the array is split into chunks and the results are merged back.
+    """
+
+    writeFunctionPattern = re.compile(r"_(create|add|enrol|unenrol|update|delete|remove|assign|unassign)_")
+
+
+    @staticmethod
+    def find_array_argument(name: str, input_schema: Any) -> Optional[str]:
+        """Return the name of the argument that can be split into chunks, or None if the function can not be chunked."""
+        allowed = [f.strip() for f in Settings.get_str("MOODLE_CHUNK_FUNCTIONS").split(",") if f.strip()]
+        if not (name in allowed or BulkChunker.writeFunctionPattern.search(name)):
+            return None
+        properties = input_schema.get("properties") if isinstance(input_schema, dict) else None
+        if not isinstance(properties, dict):
+            return None
+        # Options added by this server (for example 'mcp_fields') are not arguments of the Moodle function.
+        arrays = [key for key, schema in properties.items() if isinstance(schema, dict) and schema.get("type") == "array"
+                  and key not in ResultProjection.inputOptions]
+        if len(arrays) != 1:
+            return None
+        items = properties[arrays[0]].get("items")
+        return arrays[0] if isinstance(items, dict) and items.get("type") == "object" else None
+
+
+    @staticmethod
+    def split(arguments: Dict[str, Any], key: str) -> List[Tuple[int, List[Any]]]:
+        """
+        Split the array argument into chunks of at most MOODLE_CHUNK_SIZE elements, each fitting into MOODLE_MAX_INPUT_VARS
+        request fields together with the other arguments. Returns (offset of the first element, elements) tuples.
+        """
+        maxitems = max(1, Settings.get_int("MOODLE_CHUNK_SIZE", 100))
+        others = {k: v for k, v in arguments.items() if k != key}
+        # Two more fields are added to every request: wstoken and wsfunction.
+        maxfields = max(1, Settings.get_int("MOODLE_MAX_INPUT_VARS", 1000) - BulkChunker._count_fields(others) - 2)
+
+        chunks: List[Tuple[int, List[Any]]] = []
+        current: List[Any] = []
+        start = fields = 0
+        for index, item in enumerate(arguments.get(key) or []):
+            itemfields = BulkChunker._count_fields(item)
+            if current and (len(current) >= maxitems or fields + itemfields > maxfields):
+                chunks.append((start, current))
+                current, start, fields = [], index, 0
+            current.append(item)
+            fields += itemfields
+        if current:
+            chunks.append((start, current))
+        return chunks
+
+
+    @staticmethod
+    def _count_fields(value: Any) -> int:
+        """Number of request fields the value is encoded into."""
+        count = 0
+        stack = [value]
+        while stack:
+            value = stack.pop()
+            if isinstance(value, dict):
+                stack.extend(value.values())
+            elif isinstance(value, list):
+                stack.extend(value)
+            else:
+                count += 1
+        return count
+
+
+    @staticmethod
+    async def execute(baseurl: str, wstoken: str, name: str, arguments: Dict[str, Any],
+                      normalizer: Optional[Normalizer], input_schema: Any,
+                      transform: Optional[Callable[[Any], Dict[str, Any]]] = None,
+                      fields: Optional[Dict[str, Any]] = None) -> ToolResult:
+        """
+        Execute the web service, in several concurrent chunks if the function is a bulk write function and the input is large.
+        Transform builds the structured content from the (merged) result, fields allow to drop unneeded fields while parsing.
+        """
+        key = BulkChunker.find_array_argument(name, input_schema)
+        chunks = BulkChunker.split(arguments, key) if key is not None and isinstance(arguments.get(key), list) else []
+        if len(chunks) <= 1:
+            return await MoodleTool.execute_moodle_web_service(baseurl, wstoken, name, arguments, normalizer, transform, fields)
+
+        semaphore = asyncio.Semaphore(max(1, Settings.get_int("MOODLE_CHUNK_CONCURRENCY", 4)))
+
+        async def execute_chunk(chunk: List[Any]) -> Any:
+            async with semaphore:
+                return await MoodleTool.call_moodle_web_service(baseurl, wstoken, name, {**arguments, key: chunk}, normalizer)
+
+        outcomes = await asyncio.gather(*[execute_chunk(chunk) for _, chunk in chunks], return_exceptions=True)
+
+        results: List[Any] = []
+        errors: List[str] = []
+        for (start, chunk), outcome in zip(chunks, outcomes):
+            if isinstance(outcome, Exception):
+                errors.append(f"Elements {start}-{start + len(chunk) - 1} of '{key}' failed: {str(outcome)}")
+            elif isinstance(outcome, BaseException):
+                raise outcome
+            else:
+                results.append(outcome)
+
+        if not results:
+            raise ToolError(f"All {len(chunks)} requests failed.\n" + "\n".join(errors))
+        merged = BulkChunker.merge_results(results)
+        structured_content = transform(merged) if transform is not None else {"result": merged}
+        if not errors:
+            return ToolResult(structured_content=structured_content)
+        report = (f"The call was split into {len(chunks)} requests, {len(errors)} of them failed. "
+                  "The result only contains data from the successful requests.\n" + "\n".join(errors))
+        return ToolResult(content=[TextContent(type="text", text=report)], structured_content=structured_content)
+
+
+    @staticmethod
+    def merge_results(results: List[Any]) -> Any:
+        """Merge results of the chunks: lists are concatenated, in objects the list properties (such as warnings) are concatenated."""
+        if all(result is None for result in results):
+            return None
+        if all(isinstance(result, list) for result in results):
+            return [element for result in results for element in result]
+        if all(isinstance(result, dict) for result in results):
+            merged: Dict[str, Any] = {}
+            for result in results:
+                for k, v in result.items():
+                    if k not in merged:
+                        merged[k] = list(v) if isinstance(v, list) else v
+                    elif isinstance(v, list) and isinstance(merged[k], list):
+                        merged[k].extend(v)
+            return merged
+        return results[-1]
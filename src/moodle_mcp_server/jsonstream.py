@@ -0,0 +1,178 @@
+import importlib.util
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import httpx
+from .metrics import Metrics
+from .projection import ResultProjection
+from .settings import Settings
+
+
+class _AsyncReader:
+    """File-like object over the response chunks, as expected by the asynchronous ijson functions."""
+
+    def __init__(self, chunks: AsyncIterator[bytes]) -> None:
+        self._chunks = chunks
+        self._pending = b""
+        self.size = 0
+
+
+    async def read(self, size: int = -1) -> bytes:
+        if size == 0:
+            # ijson reads zero bytes to find out if the file is binary.
+            return b""
+        if self._pending:
+            data, self._pending = self._pending, b""
+            return data
+        try:
+            data = await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return b""
+        self.size += len(data)
+        return data
+
+
+    async def peek(self) -> int:
+        """First non-whitespace byte of the document (0 if it is empty), without consuming it."""
+        while True:
+            if not self._pending:
+                self._pending = await self.read()
+                if not self._pending:
+                    return 0
+            stripped = self._pending.lstrip()
+            if stripped:
+                self._pending = stripped
+                return stripped[0]
+            self._pending = b""
+
+
+class _ProjectingBuilder:
+    """
+    Builds the projected value from ijson parse events. Values of fields that are not in the projection tree are
+    skipped without being built, so only the requested fields of every element are ever held in memory.
+    """
+
+    _starts = ("start_map", "start_array")
+    _ends = ("end_map", "end_array")
+
+    def __init__(self, tree: Optional[Dict[str, Any]], keep: Tuple[str, ...] = ()) -> None:
+        self.value: Any = None
+        # Open containers: [container, projection tree of its elements or fields, pending key of a map].
+        self._stack: List[List[Any]] = []
+        self._tree = tree
+        # Top-level fields that are kept even if they are not in the tree.
+        self._keep = keep
+        self._skip = 0
+
+
+    def feed(self, events: List[Tuple[str, Any]]) -> None:
+        stack, starts, ends = self._stack, self._starts, self._ends
+        skip = self._skip
+        for event, value in events:
+            if skip:
+                if event in starts:
+                    skip += 1
+                elif event in ends:
+                    skip -= 1
+                continue
+            if event == "map_key":
+                stack[-1][2] = value
+                continue
+            if event in ends:
+                stack.pop()
+                continue
+
+            if not stack:
+                subtree = self._tree
+                container = None
+            else:
+                container, tree, key = stack[-1]
+                if tree is None or container.__class__ is list:
+                    subtree = tree
+                else:
+                    subtree = tree.get(key, tree.get("*", False))
+                    if subtree is False:
+                        if len(stack) > 1 or key not in self._keep:
+                            if event in starts:
+                                skip = 1
+                            continue
+                        subtree = None
+
+            if event == "start_map":
+                value = {}
+                stack.append([value, subtree, None])
+            elif event == "start_array":
+                value = []
+                stack.append([value, subtree, None])
+            if container is None:
+                self.value = value
+            elif container.__class__ is list:
+                container.append(value)
+            else:
+                container[key] = value
+        self._skip = skip
+
+
+class JsonStream:
+    """
+    Incremental parsing of large JSON responses with ijson (its C backend when available), used when the caller
+    only needs some fields of the result.
+
+    The response is never held in memory as bytes and text at the same time as the parsed objects. Elements of
+    the top-level array are built one by one and the requested field projection is applied to each of them right away.
+    A top-level object (typically a wrapper like {"courses": [...], "warnings": []}) is built from the parse events
+    and the fields that are not requested are skipped without being built, also inside its arrays.
+    Without the optional 'ijson' package, or for small responses, the body is read and parsed at once.
+    """
+
+    # Keys of the Moodle error response, kept by the projection so that errors are still detected.
+    errorKeys = ("exception", "errorcode", "message", "debuginfo")
+
+
+    @staticmethod
+    def available() -> bool:
+        return Settings.get_bool("MOODLE_STREAM_PARSE", True) and importlib.util.find_spec("ijson") is not None
+
+
+    @staticmethod
+    async def parse(response: httpx.Response, tree: Optional[Dict[str, Any]]) -> Any:
+        """Parse the body of the streamed response, keeping only the fields from the projection tree."""
+        length = response.headers.get("content-length")
+        if tree is None or (length is not None and length.isdigit()
+                            and int(length) < Settings.get_int("MOODLE_STREAM_PARSE_MIN_BYTES", 1024 * 1024)):
+            # Without a projection the standard parser is faster and uses less memory (it shares the strings of
+            # repeated keys), the incremental parsing only pays off when most of the response can be dropped.
+            content = await response.aread()
+            Metrics.observe_size("response", len(content))
+            return json.loads(content)
+
+        import ijson
+        reader = _AsyncReader(response.aiter_bytes())
+        first = await reader.peek()
+        if first == ord("["):
+            result: Any = [ResultProjection.project(item, tree)
+                           async for item in ijson.items_async(reader, "item", use_float=True)]
+        elif first == ord("{"):
+            builder = _ProjectingBuilder(tree, JsonStream.errorKeys)
+            # The push interface of ijson collects the events of a whole chunk, iterating over them is much faster
+            # than getting them one by one from the asynchronous parser.
+            events = ijson.sendable_list()
+            parser = ijson.basic_parse_coro(events, use_float=True)
+            chunk = await reader.read()
+            while chunk:
+                parser.send(chunk)
+                builder.feed(events)
+                del events[:]
+                chunk = await reader.read()
+            parser.close()
+            builder.feed(events)
+            result = builder.value
+            if tree is not None and "exception" not in result:
+                wildcard = tree.get("*", False)
+                result = {key: value for key, value in result.items() if tree.get(key, wildcard) is not False}
+        else:
+            chunks = [await reader.read()]
+            while chunks[-1]:
+                chunks.append(await reader.read())
+            result = json.loads(b"".join(chunks))
+        Metrics.observe_size("response", reader.size)
+        return result
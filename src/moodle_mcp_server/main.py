@@ -1,5 +1,10 @@
+import hmac
 from fastmcp import FastMCP, Context
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response
+from moodle_mcp_server.metrics import Metrics
 from moodle_mcp_server.middleware import MoodleMiddleware
+from moodle_mcp_server.settings import Settings
 from moodle_mcp_server import __version__
 
 
@@ -13,8 +18,25 @@ mcp = FastMCP(
     icons=[MoodleMiddleware.icon]
 )
 
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics(request: Request) -> Response:
+    """Metrics in the Prometheus text format, available in the HTTP mode to requests with the MOODLE_METRICS_TOKEN bearer token."""
+    token = Settings.get_str("MOODLE_METRICS_TOKEN")
+    if not Metrics.enabled or not token:
+        return PlainTextResponse("Metrics are disabled", status_code=404)
+    scheme, _, credentials = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(credentials.strip().encode('utf-8'), token.encode('utf-8')):
+        return PlainTextResponse("Unauthorized", status_code=401, headers={"WWW-Authenticate": "Bearer"})
+    return PlainTextResponse(Metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
 def main():
-    mcp.run()
+    transport = Settings.get_str("MOODLE_MCP_TRANSPORT", "stdio").lower()
+    if transport in ("http", "streamable-http", "sse"):
+        # Multi-tenant mode: every request carries the site URL and token in its headers.
+        mcp.run(transport=transport, host=Settings.get_str("MOODLE_MCP_HOST", "127.0.0.1"), port=Settings.get_int("MOODLE_MCP_PORT", 8000))
+    else:
+        mcp.run()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,199 @@
+import bisect
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from .settings import Settings
+
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Metrics:
+    """
+    In-process counters and histograms of the server: latency of each phase (calls to Moodle, lookup service,
+    normalization, whole tool calls) per function, payload sizes, errors and cache statistics.
+
+    Phases are measured with track(), which also opens an OpenTelemetry span when the optional 'opentelemetry-api'
+    package is installed. Metrics are rendered in the Prometheus text format (HTTP mode) or as a dictionary
+    (server_stats tool in stdio mode). MOODLE_METRICS=0 disables them.
+    """
+
+    latencyBuckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+    sizeBuckets = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+    enabled = Settings.get_bool("MOODLE_METRICS", True)
+    _counters: Dict[Tuple[str, Labels], float] = {}
+    # Name and labels => [count per bucket..., count above the last bucket, sum, count].
+    _histograms: Dict[Tuple[str, Labels], List[float]] = {}
+    _buckets: Dict[str, Tuple[float, ...]] = {}
+    _collectors: Dict[str, Callable[[], Dict[str, Any]]] = {}
+    # Labels of the phase being tracked in the current task, payload sizes and errors are attributed to it.
+    _current: ContextVar[Labels] = ContextVar("moodle_mcp_metrics_labels", default=())
+    _tracer: Any = None
+    _tracerLoaded = False
+
+
+    @staticmethod
+    def inc(name: str, labels: Labels = (), value: float = 1) -> None:
+        if Metrics.enabled:
+            key = (name, labels)
+            Metrics._counters[key] = Metrics._counters.get(key, 0) + value
+
+
+    @staticmethod
+    def observe(name: str, value: float, labels: Labels = (), buckets: Tuple[float, ...] = latencyBuckets) -> None:
+        if not Metrics.enabled:
+            return
+        key = (name, labels)
+        histogram = Metrics._histograms.get(key)
+        if histogram is None:
+            Metrics._buckets.setdefault(name, buckets)
+            histogram = Metrics._histograms[key] = [0.0] * (len(buckets) + 3)
+        histogram[bisect.bisect_left(Metrics._buckets[name], value)] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+
+    @staticmethod
+    def observe_size(direction: str, size: int) -> None:
+        """Record the size of a request or response body, attributed to the phase tracked in the current task."""
+        Metrics.observe("payload_bytes", size, Metrics._current.get() + (("direction", direction),), Metrics.sizeBuckets)
+
+
+    @staticmethod
+    def count_event(name: str, **labels: str) -> None:
+        """Increment the counter, attributed to the phase tracked in the current task."""
+        Metrics.inc(name, Metrics._current.get() + tuple(labels.items()))
+
+
+    @staticmethod
+    def count_moodle_exception(exception: str) -> None:
+        """Count an exception returned by Moodle (for example 'invalid_parameter_exception')."""
+        Metrics.count_event("moodle_exceptions_total", exception=exception)
+
+
+    @staticmethod
+    @contextmanager
+    def track(phase: str, function: str = "") -> Iterator[None]:
+        """Measure the duration of the phase, count its errors by type and wrap it in a tracing span."""
+        if not Metrics.enabled:
+            yield
+            return
+        labels: Labels = (("phase", phase), ("function", function))
+        tracer = Metrics._get_tracer()
+        with ExitStack() as stack:
+            if tracer is not None:
+                stack.enter_context(tracer.start_as_current_span(f"moodle.{phase}", attributes={"moodle.function": function}))
+            token = Metrics._current.set(labels)
+            start = time.perf_counter()
+            try:
+                yield
+            except BaseException as e:
+                Metrics.inc("errors_total", labels + (("type", type(e).__name__),))
+                raise
+            finally:
+                Metrics.observe("phase_seconds", time.perf_counter() - start, labels)
+                Metrics._current.reset(token)
+
+
+    @staticmethod
+    def _get_tracer() -> Any:
+        """OpenTelemetry tracer if the package is installed (spans are exported only when an SDK is configured)."""
+        if not Metrics._tracerLoaded:
+            Metrics._tracerLoaded = True
+            if Settings.get_bool("MOODLE_TRACING", True):
+                try:
+                    from opentelemetry import trace
+                    Metrics._tracer = trace.get_tracer("moodle_mcp_server")
+                except ImportError:
+                    Metrics._tracer = None
+        return Metrics._tracer
+
+
+    @staticmethod
+    def add_collector(name: str, collector: Callable[[], Dict[str, Any]]) -> None:
+        """Register a function returning numeric statistics (for example cache hits), reported as gauges."""
+        Metrics._collectors[name] = collector
+
+
+    @staticmethod
+    def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = [*labels, extra] if extra is not None else list(labels)
+        if not pairs:
+            return ""
+        escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs]
+        return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+    @staticmethod
+    def render_prometheus() -> str:
+        """All metrics in the Prometheus text exposition format."""
+        prefix = "moodle_mcp_"
+        lines: List[str] = []
+        seen = set()
+        for (name, labels), value in sorted(Metrics._counters.items()):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {prefix}{name} counter")
+            lines.append(f"{prefix}{name}{Metrics._format_labels(labels)} {value:g}")
+        for (name, labels), histogram in sorted(Metrics._histograms.items()):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {prefix}{name} histogram")
+            cumulative = 0.0
+            for bound, count in zip(Metrics._buckets[name], histogram):
+                cumulative += count
+                lines.append(f"{prefix}{name}_bucket{Metrics._format_labels(labels, ('le', f'{bound:g}'))} {cumulative:g}")
+            lines.append(f"{prefix}{name}_bucket{Metrics._format_labels(labels, ('le', '+Inf'))} {histogram[-1]:g}")
+            lines.append(f"{prefix}{name}_sum{Metrics._format_labels(labels)} {histogram[-2]:g}")
+            lines.append(f"{prefix}{name}_count{Metrics._format_labels(labels)} {histogram[-1]:g}")
+        for collector, stats in Metrics._collect().items():
+            for key, value in stats.items():
+                lines.append(f"# TYPE {prefix}{collector}_{key} gauge")
+                lines.append(f"{prefix}{collector}_{key} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+    @staticmethod
+    def _collect() -> Dict[str, Dict[str, float]]:
+        collected: Dict[str, Dict[str, float]] = {}
+        for name, collector in Metrics._collectors.items():
+            collected[name] = {k: v for k, v in collector().items() if isinstance(v, (int, float)) and not isinstance(v, bool)}
+        return collected
+
+
+    @staticmethod
+    def quantile(name: str, labels: Labels, q: float) -> Optional[float]:
+        """Upper bound of the histogram bucket containing the given quantile, None if there are no observations."""
+        histogram = Metrics._histograms.get((name, labels))
+        if not histogram or not histogram[-1]:
+            return None
+        target = q * histogram[-1]
+        cumulative = 0.0
+        for bound, count in zip(Metrics._buckets[name], histogram):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return float("inf")
+
+
+    @staticmethod
+    def snapshot() -> Dict[str, Any]:
+        """Summary of the metrics for the server_stats tool."""
+        phases: List[Dict[str, Any]] = []
+        for (name, labels), histogram in sorted(Metrics._histograms.items()):
+            if name != "phase_seconds":
+                continue
+            item: Dict[str, Any] = dict(labels)
+            item["count"] = int(histogram[-1])
+            item["avg_seconds"] = round(histogram[-2] / histogram[-1], 6) if histogram[-1] else 0
+            item["p50_seconds"] = Metrics.quantile(name, labels, 0.5)
+            item["p99_seconds"] = Metrics.quantile(name, labels, 0.99)
+            item["errors"] = int(sum(v for (n, l), v in Metrics._counters.items() if n == "errors_total" and l[:2] == labels))
+            phases.append(item)
+        payloads = [{**dict(labels), "count": int(h[-1]), "bytes": int(h[-2])}
+                    for (name, labels), h in sorted(Metrics._histograms.items()) if name == "payload_bytes"]
+        exceptions = [{**dict(labels), "count": int(v)}
+                      for (name, labels), v in sorted(Metrics._counters.items()) if name == "moodle_exceptions_total"]
+        return {"phases": phases, "payloads": payloads, "moodle_exceptions": exceptions, **Metrics._collect()}
@@ -1,31 +1,91 @@
+import asyncio
 import hashlib
 import json
+import logging
+import time
 from collections.abc import Sequence
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from fastmcp import Context
-from fastmcp.exceptions import FastMCPError
+from fastmcp.exceptions import FastMCPError, ToolError
 from fastmcp.server.middleware.middleware import Middleware, MiddlewareContext
 from fastmcp.tools.tool import Tool, ToolResult
 from typing_extensions import override
+from .catalog import CatalogEntry, SiteKey, ToolCatalogCache
+from .chunking import BulkChunker
+from .metrics import Metrics
+from .projection import ResultPages, ResultProjection
+from .registry import CachedTool, ToolRegistry, ToolVariant
+from .resilience import Resilience
+from .schemastore import SchemaStore
+from .settings import Settings
+from .singleflight import SingleFlight
+from .tenants import TenantTracker
 from .tools import MoodleTool
+from .transport import HttpTransport
 from .utils import Utils
 from mcp.types import Icon
 import os
 
 
+logger = logging.getLogger(__name__)
+
+
 class MoodleMiddleware(Middleware):
     """Middleware class for Moodle API communication."""
 
     moodleLogo = "data:image/svg+xml;base64,PHN2ZyB4bWxucz0iaHR0cDovL3d3dy53My5vcmcvMjAwMC9zdmciIHZpZXdCb3g9IjAgMCAyNCAyNCI+CiAgICA8cGF0aCBzdHlsZT0ibGluZS1oZWlnaHQ6bm9ybWFsO3RleHQtaW5kZW50OjA7dGV4dC1hbGlnbjpzdGFydDt0ZXh0LWRlY29yYXRpb24tbGluZTpub25lO3RleHQtZGVjb3JhdGlvbi1zdHlsZTpzb2xpZDt0ZXh0LWRlY29yYXRpb24tY29sb3I6IzAwMDt0ZXh0LXRyYW5zZm9ybTpub25lO2Jsb2NrLXByb2dyZXNzaW9uOnRiO2lzb2xhdGlvbjphdXRvO21peC1ibGVuZC1tb2RlOm5vcm1hbCIgZD0iTSAxNCAzIEwgNiA0IEwgMCA4IEwgMSA4IEwgMSAxOCBMIDIgMTggTCAyIDggTCA0LjAxMTcxODggOCBDIDQuMDA5NTAxMSA4LjA2NzQ2NDIgNCA4LjEyMzQ0NTYgNCA4LjE5MzM1OTQgQyA0IDkuMzc3MzU5NCA0LjMyMjI2NTYgMTAuMTk3MjY2IDQuMzIyMjY1NiAxMC4xOTcyNjYgTCA4Ljc2NTYyNSAxMS4yNjE3MTkgTCAxMi4wMTM2NzIgNy41ODc4OTA2IEMgMTIuMDEzNjcyIDcuNTg3ODkwNiAxMS43MTk2MjQgNi4zNjAzODQ1IDExLjA0ODgyOCA1LjQ1ODk4NDQgTCAxNCAzIHogTSAxOC41IDcgQyAxNi45MjkwMTIgNyAxNS41MDc2NDkgNy42NzQ4NzEyIDE0LjUwMTk1MyA4Ljc0NDE0MDYgQyAxNC4yNDM1ODggOC40NjkzOTggMTMuOTYxNjUxIDguMjE1NDU2OSAxMy42NTIzNDQgNy45OTgwNDY5IEwgMTEuNjMyODEyIDEwLjI4MzIwMyBDIDEyLjQ0MDgxMiAxMC42OTgyMDMgMTMgMTEuNTMxIDEzIDEyLjUgTCAxMyAyMCBMIDE2IDIwIEwgMTYgMTIuNSBDIDE2IDExLjEwMTc3NCAxNy4xMDE3NzQgMTAgMTguNSAxMCBDIDE5Ljg5ODIyNiAxMCAyMSAxMS4xMDE3NzQgMjEgMTIuNSBMIDIxIDIwIEwgMjQgMjAgTCAyNCAxMi41IEMgMjQgOS40ODAyMjU5IDIxLjUxOTc3NCA3IDE4LjUgNyB6IE0gNS4wMzMyMDMxIDExLjkxMDE1NiBDIDUuMDEyMjAzMSAxMi4xMDQxNTYgNSAxMi4zMDEgNSAxMi41IEwgNSAyMCBMIDggMjAgTCA4IDEyLjYyMTA5NCBMIDUuMDMzMjAzMSAxMS45MTAxNTYgeiIgZm9udC13ZWlnaHQ9IjQwMCIgZm9udC1mYW1pbHk9InNhbnMtc2VyaWYiIHdoaXRlLXNwYWNlPSJub3JtYWwiIG92ZXJmbG93PSJ2aXNpYmxlIi8+Cjwvc3ZnPg=="
     icon = Icon(src=moodleLogo, mimeType="image/svg+xml")
+    lookupUrl = "https://api.mcp-ready.lmscloud.io/noauth/lookup"
 
 
     def __init__(self) -> None:
-        self._all_client_tools: Dict[str, Dict[str, Tool]] = {}
+        self.lookupUrl = Settings.get_str("MOODLE_LOOKUP_URL", self.lookupUrl)
+        self._registry = ToolRegistry(
+            max_variants=Settings.get_int("MOODLE_TOOL_VARIANTS", 8),
+            max_toolsets=Settings.get_int("MOODLE_TOOLSETS", Settings.get_int("MOODLE_MAX_TENANTS", 1000)),
+        )
+        self._catalog = ToolCatalogCache(ttl=Settings.get_float("MOODLE_TOOLS_CACHE_TTL", 300))
+        self._background_tasks: set[asyncio.Task] = set()
+        self._schema_store = SchemaStore(SchemaStore.default_path())
+        self._batch_call_tool = self._create_tool_from_info(MoodleTool.batchCallInfo)
+        self._server_stats_tool = (self._create_tool_from_info(MoodleTool.serverStatsInfo)
+                                   if Settings.get_str("MOODLE_MCP_TRANSPORT", "stdio").lower() == "stdio" and Metrics.enabled else None)
+        self._catalog_loads = SingleFlight()
+        # Time of the last catalog synchronization caused by a call of an unregistered tool, per site.
+        self._last_syncs: Dict[SiteKey, float] = {}
+        self._pages = ResultPages(ttl=Settings.get_float("MOODLE_CURSOR_TTL", 300), max_entries=Settings.get_int("MOODLE_CURSOR_MAX_ENTRIES", 50))
+        self._tenants = TenantTracker(
+            idle_ttl=Settings.get_float("MOODLE_TENANT_IDLE_TTL", 3600),
+            max_tenants=Settings.get_int("MOODLE_MAX_TENANTS", 1000),
+        )
+        Metrics.add_collector("registry", self._registry.stats)
+        Metrics.add_collector("catalog", self._catalog.stats)
+        Metrics.add_collector("catalog_loads", self._catalog_loads.stats)
+        Metrics.add_collector("tenants", self._tenants.stats)
+        Metrics.add_collector("response_cache", MoodleTool.responseCache.stats)
+        Metrics.add_collector("inflight", MoodleTool.inflight.stats)
+        Metrics.add_collector("upstream", Resilience.stats)
+        Metrics.add_collector("cursors", self._pages.stats)
 
 
     async def _get_credentials(self, ctx: Context) -> tuple[str, str]:
-        """Retrieves Moodle credentials (site URL and web service token) from HTTP headers or environment variables."""
+        """
+        Retrieves Moodle credentials (site URL and web service token) from HTTP headers or environment variables.
+
+        In the HTTP mode the headers are required, the credentials from the environment are only used for requests
+        without headers if MOODLE_HTTP_ENV_CREDENTIALS is enabled.
+        """
+        baseurl, wstoken = Utils.get_credentials_from_headers()
+        if baseurl != "" or wstoken != "":
+            # Never combine the site from the headers with the token from the environment or vice versa.
+            if wstoken == "" or not Utils.is_valid_url(baseurl):
+                raise FastMCPError("Missing Moodle credentials. Please send the site URL in the 'X-Moodle-Url' header and the web service token in the 'X-Moodle-Token' or 'Authorization: Bearer' header.")
+            if not self._is_allowed_site(baseurl):
+                raise FastMCPError(f"The site {baseurl} is not allowed on this server.")
+            return baseurl, wstoken
+
+        if Utils.is_http_mode() and not Settings.get_bool("MOODLE_HTTP_ENV_CREDENTIALS", False):
+            raise FastMCPError("Missing Moodle credentials. Please send the site URL in the 'X-Moodle-Url' header and the web service token in the 'X-Moodle-Token' or 'Authorization: Bearer' header.")
         wstoken = os.environ.get("TOKEN", "").strip()
         baseurl = Utils.clean_baseurl(os.environ.get("MOODLE", ""), True)
         if wstoken == "" or baseurl == "":
@@ -33,6 +93,33 @@ class MoodleMiddleware(Middleware):
         return baseurl, wstoken
 
 
+    @staticmethod
+    def _is_allowed_site(baseurl: str) -> bool:
+        """
+        Sites that can be passed in the headers must match the comma-separated list in MOODLE_ALLOWED_SITES (see Utils.url_matches).
+        Without the list no site from the headers is allowed, so that the server can not be used to send requests to internal addresses.
+        """
+        return Utils.url_matches(baseurl, Settings.get_str("MOODLE_ALLOWED_SITES"))
+
+
+    def _touch_tenant(self, site: SiteKey) -> None:
+        """Remember that the site is in use and evict the state of the sites that have been idle for too long."""
+        for evicted in self._tenants.touch(site):
+            self._evict_tenant(evicted)
+
+
+    def _evict_tenant(self, site: SiteKey) -> None:
+        """Drop everything that is kept in memory for the site."""
+        self._registry.forget_site(site)
+        self._catalog.invalidate(site)
+        MoodleTool.responseCache.forget_site(site)
+        self._pages.forget_site(site)
+        self._last_syncs.pop(site, None)
+        poolkey = HttpTransport.pool_key(site[0])
+        if not any(HttpTransport.pool_key(other[0]) == poolkey for other in self._tenants.sites()):
+            HttpTransport.release_pool(site[0])
+
+
     @override
     async def on_list_tools(
         self,
@@ -40,8 +127,10 @@ class MoodleMiddleware(Middleware):
         call_next,
     ) -> Sequence[Tool]:
         """Inject tools into the response."""
-        client_tools = await self._load_tools(context.fastmcp_context)
-        return [*client_tools, *await call_next(context)]
+        with Metrics.track("list_tools"):
+            client_tools = await self._load_tools(context.fastmcp_context)
+        extra_tools = [self._batch_call_tool] if self._server_stats_tool is None else [self._batch_call_tool, self._server_stats_tool]
+        return [*client_tools, *extra_tools, *await call_next(context)]
 
 
     @override
@@ -51,75 +140,277 @@ class MoodleMiddleware(Middleware):
         call_next,
     ) -> ToolResult:
         """Intercept tool calls to injected tools."""
+        if context.message.name == "server_stats" and self._server_stats_tool is not None:
+            return ToolResult(structured_content=Metrics.snapshot())
+        with Metrics.track("tool", self._metrics_label(context.message.name)):
+            return await self._call_tool(context)
+
+
+    def _metrics_label(self, tool_name: str) -> str:
+        """Name of the tool used as a metrics label, names that were never listed are not recorded as they come from the client."""
+        if tool_name in ("upload_files", "download_file", "batch_call") or self._registry.has_tool(tool_name):
+            return tool_name
+        return "unknown"
+
+
+    async def _call_tool(self, context: MiddlewareContext) -> ToolResult:
+        """Execute the called tool."""
         baseurl, wstoken = await self._get_credentials(context.fastmcp_context)
         tool_name = context.message.name
         arguments = context.message.arguments or {}
 
+        site = self._site_key(baseurl, wstoken)
+        self._touch_tenant(site)
         if tool_name == "upload_files":
             return await MoodleTool.upload_files(baseurl, wstoken, arguments)
         elif tool_name == "download_file":
             return await MoodleTool.download_file(baseurl, wstoken, arguments)
-
-        if not tool_name in self._all_client_tools:
-            # Something somewhere expired or server restarted. We need to send an error and tell the client to re-request list of tools.
-            await context.fastmcp_context.send_tool_list_changed()
-            raise FastMCPError(f"Something went wrong, there is a possible cache issue in the MCP server. Please repeat the request.")
-
-        tool = self._all_client_tools[tool_name]
-        return await MoodleTool.execute_moodle_web_service(
+        if tool_name == "batch_call":
+            return await MoodleTool.batch_call(baseurl, wstoken, arguments, await self._batch_normalizers(site, context.fastmcp_context, arguments))
+        variant = self._registry.lookup(site, tool_name)
+        if variant is None:
+            # Something somewhere expired or server restarted, or the client uses an old list of tools.
+            variant = await self._sync_catalog(site, context.fastmcp_context, tool_name)
+
+        # Options that select fields and paginate the result are handled by this server, they are not sent to Moodle.
+        arguments, projection, cursor = ResultProjection.from_arguments(arguments)
+        if cursor is not None:
+            return ToolResult(structured_content=self._pages.resume(site, tool_name, cursor, projection.limit))
+
+        return await BulkChunker.execute(
             baseurl=baseurl,
             wstoken=wstoken,
             name=tool_name,
             arguments=arguments,
-            # We pass output_schema so we can fix empty arrays in the result. A bit stupid that because of Moodle bug we need to
-            # add a huge layer of caching.
-            tools=tool.values(),
+            # We pass normalizer compiled from output_schema so we can fix empty arrays in the result. A bit stupid that because
+            # of Moodle bug we need to add a layer of caching. Only the variant of the tool that was listed to this site is used.
+            normalizer=variant.normalizer,
+            # Input schema tells if this is a bulk function that can be split into several requests.
+            input_schema=variant.tool.parameters,
+            transform=(lambda result: self._pages.paginate(site, tool_name, result, projection)) if projection is not None else None,
+            fields=projection.tree if projection is not None else None,
         )
 
 
-    async def _load_functions_from_wsdiscovery(self, ctx: Context) -> List[Dict[str, Any]]:
+    async def _load_functions_from_wsdiscovery(self, ctx: Context) -> Tuple[Dict[str, Any], Optional[str]]:
         """If tool_wsdiscovery plugin is installed on the Moodle site, use it to get the list of available functions."""
         baseurl, wstoken = await self._get_credentials(ctx)
 
-        structure = Utils.request_post_json(f"{baseurl}/admin/tool/wsdiscovery/moodle.php",
-                                    headers={'Authorization': 'Bearer ' + wstoken})
-        functions = structure.get("functions", [])
-        return self._prepare_schemas({"functions": functions})
+        structure = await Utils.request_post_json(f"{baseurl}/admin/tool/wsdiscovery/moodle.php",
+                                    headers={'Authorization': 'Bearer ' + wstoken}, idempotent=True)
+        if not isinstance(structure, dict) or not isinstance(structure.get("functions", []), list):
+            raise FastMCPError("Unexpected response from tool_wsdiscovery")
+        return {"functions": structure.get("functions", [])}, None
 
 
-    async def _load_functions_from_site_info(self, ctx: Context) -> List[Dict[str, Any]]:
+    async def _load_functions_from_site_info(self, ctx: Context) -> Tuple[Dict[str, Any], Optional[str]]:
         """Request a list of available functions using core_webservice_get_site_info external function (fallback if tool_wsdiscovery is not installed)."""
         baseurl, wstoken = await self._get_credentials(ctx)
-        result = await MoodleTool.execute_moodle_web_service(
+        siteinfo = await MoodleTool.call_moodle_web_service(
             baseurl=baseurl,
             wstoken=wstoken,
             name="core_webservice_get_site_info",
-            arguments={},
-            tools=[])
-        content, structured_content = result.to_mcp_result()
-        function_names = structured_content.get("result", {}).get("functions", [])
-        return self._prepare_schemas({"functionnames": function_names})
-
-
-    def _prepare_schemas(self, payload: Dict[str, Any]) -> List[Dict[str, Any]]:
-        """Request the function schemas from MCP Ready lookup service. Your credentials are never sent to this service."""
-        jsonresult = Utils.request_post_json("https://api.mcp-ready.lmscloud.io/noauth/lookup", json=payload)
-        return jsonresult.get("functions", []) if isinstance(jsonresult, dict) else []
+            arguments={})
+        function_names = siteinfo.get("functions", [])
+        site_version = f"{siteinfo.get('release')}|{siteinfo.get('version')}"
+        return {"functionnames": function_names}, site_version
+
+
+    async def _prepare_schemas(self, payload: Dict[str, Any], site_version: Optional[str] = None,
+                               previous: Optional[CatalogEntry] = None) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+        """
+        Request the function schemas from MCP Ready lookup service. Your credentials are never sent to this service.
+
+        Definitions of the functions that did not change since the previous catalog of the site are reused, only the
+        functions that are not yet in the local schema store are sent to the lookup service. If the service
+        is unreachable, the most recent stored schemas are used instead. Returns the definitions and the fingerprints of the functions.
+        """
+        field, items = next(iter(payload.items()))
+        keyed = [(self._function_name(item), SchemaStore.fingerprint(item, site_version), item) for item in items]
+        requested_names = {name for name, _, _ in keyed}
+        reused: Dict[str, Dict[str, Any]] = {}
+        previous_extras: List[Dict[str, Any]] = []
+        if previous is not None:
+            definitions = {f.get("name"): f for f in previous.functions}
+            reused = {name: definitions[name] for name, fingerprint, _ in keyed
+                      if name in definitions and previous.fingerprints.get(name) == fingerprint}
+            previous_extras = [f for f in previous.functions if f.get("name") in previous.extras]
+        keyed_new = [(name, fingerprint, item) for name, fingerprint, item in keyed if name not in reused]
+        # The schema store is an SQLite database, it is used from a worker thread so that a locked database does not block the event loop.
+        stored = await asyncio.to_thread(self._schema_store.get_many, [(name, fingerprint) for name, fingerprint, _ in keyed_new])
+        missing = [(name, fingerprint, item) for name, fingerprint, item in keyed_new if (name, fingerprint) not in stored]
+
+        looked_up: Dict[str, Dict[str, Any]] = {}
+        unresolved: set[str] = set()
+        if missing:
+            try:
+                with Metrics.track("lookup"):
+                    jsonresult = await Utils.request_post_json(self.lookupUrl, json={field: [item for _, _, item in missing]}, idempotent=True)
+            except FastMCPError as e:
+                looked_up = await asyncio.to_thread(self._schema_store.get_latest, [name for name, _, _ in missing])
+                if not stored and not looked_up and not reused:
+                    raise
+                unresolved = {name for name, _, _ in missing}
+                logger.warning("MCP Ready lookup service is not available, using cached schemas: %s", e)
+            else:
+                if isinstance(jsonresult, dict) and isinstance(jsonresult.get("functions"), list):
+                    looked_up = {f.get("name"): f for f in jsonresult["functions"] if isinstance(f, dict)}
+                    await asyncio.to_thread(
+                        self._schema_store.put_many,
+                        [(name, fingerprint, looked_up.get(name)) for name, fingerprint, _ in missing] +
+                        [(name, SchemaStore.EXTRA, f) for name, f in looked_up.items() if name not in requested_names])
+
+        functions: List[Dict[str, Any]] = []
+        for name, fingerprint, _ in keyed:
+            if name in reused:
+                definition: Optional[Dict[str, Any]] = reused[name]
+            else:
+                definition = stored[(name, fingerprint)] if (name, fingerprint) in stored else looked_up.get(name)
+            if definition is not None:
+                functions.append(definition)
+
+        # Helper tools (not Moodle functions) that the lookup service adds to its response.
+        extras = {name: f for name, f in looked_up.items() if name not in requested_names}
+        for f in await asyncio.to_thread(self._schema_store.get_extras) + previous_extras:
+            if f.get("name") not in requested_names:
+                extras.setdefault(f.get("name"), f)
+        # Functions that could not be looked up get no fingerprint, so that they are looked up again on the next refresh.
+        return functions + list(extras.values()), {name: fingerprint for name, fingerprint, _ in keyed if name not in unresolved}
+
+
+    @staticmethod
+    def _function_name(item: Any) -> str:
+        """Name of the function in the list returned by tool_wsdiscovery or core_webservice_get_site_info."""
+        return str(item.get("name", "")) if isinstance(item, dict) else str(item)
 
 
     async def _load_tools(self, ctx: Context) -> List[Tool]:
         """Load available Moodle tools from the site."""
-        functions = await self._load_function_definitions(ctx)
-        return self._register_tools(functions)
+        site = self._site_key(*await self._get_credentials(ctx))
+        self._touch_tenant(site)
+        entry = await self._get_cached_function_definitions(ctx)
+        return self._register_tools(site, entry)
+
+
+    @staticmethod
+    def _site_key(baseurl: str, wstoken: str) -> SiteKey:
+        return baseurl, Utils.token_fingerprint(wstoken)
 
 
-    async def _load_function_definitions(self, ctx: Context) -> List[Dict[str, Any]]:
-        """Load function definitions from Moodle using available methods."""
+    async def _get_cached_function_definitions(self, ctx: Context) -> CatalogEntry:
+        """Return function definitions from the catalog cache, loading them on a miss and refreshing stale ones in the background."""
+        key = self._site_key(*await self._get_credentials(ctx))
+        entry = self._catalog.get(key)
+        if entry is None:
+            # Concurrent requests for the list of tools of the same site share one load.
+            entry = await self._catalog_loads.run(key, lambda: self._load_catalog(ctx))
+            entry, _ = self._catalog.put(key, entry)
+            return entry
+
+        if self._catalog.is_stale(entry) and entry.refresh_task is None:
+            entry.refresh_task = asyncio.create_task(self._refresh_catalog(key, ctx, entry))
+            self._background_tasks.add(entry.refresh_task)
+            entry.refresh_task.add_done_callback(self._background_tasks.discard)
+        return entry
+
+
+    async def _refresh_catalog(self, key: SiteKey, ctx: Context, previous: CatalogEntry) -> None:
+        """Check the function list of the site for changes and notify the client if the list of tools has changed."""
+        session = ctx.session
         try:
-            return await self._load_functions_from_wsdiscovery(ctx)
+            entry = await self._catalog_loads.run(key, lambda: self._load_catalog(ctx, previous))
+            entry, changed = self._catalog.put(key, entry)
+            if changed:
+                self._register_tools(key, entry)
+                await self._notify_tool_list_changed(session)
+        except FastMCPError as e:
+            # Keep serving the stale catalog, the next request will try to refresh it again.
+            logger.warning("Failed to refresh the list of tools for %s: %s", key[0], e)
+        except Exception:
+            logger.exception("Failed to refresh the list of tools for %s", key[0])
+        finally:
+            previous.refresh_task = None
+
+
+    async def _sync_catalog(self, site: SiteKey, ctx: Context, tool_name: str) -> ToolVariant:
+        """
+        Find the tool that was called but is not registered for the site.
+
+        The tool is registered again from the cached catalog if it is there (its variant may have been evicted from
+        the registry). Only if it is missing and the catalog is stale (or not cached), the catalog of the site is
+        synchronized, at most once per MOODLE_CATALOG_SYNC_INTERVAL seconds, and the client is notified only if the list
+        of tools has changed.
+        """
+        entry = self._catalog.peek(site)
+        variant = self._restore_tool(site, entry, tool_name) if entry is not None else None
+        if variant is not None:
+            return variant
+
+        now = time.monotonic()
+        interval = Settings.get_float("MOODLE_CATALOG_SYNC_INTERVAL", 30)
+        if (entry is None or self._catalog.is_stale(entry)) and now - self._last_syncs.get(site, now - interval) >= interval:
+            self._last_syncs[site] = now
+            loaded = await self._catalog_loads.run(site, lambda: self._load_catalog(ctx, entry))
+            loaded, changed = self._catalog.put(site, loaded)
+            if changed:
+                self._register_tools(site, loaded)
+                await self._notify_tool_list_changed(ctx.session)
+            variant = self._restore_tool(site, loaded, tool_name)
+            if variant is not None:
+                return variant
+        raise ToolError(f"Tool '{tool_name}' is not available on this Moodle site. Request the list of tools again.")
+
+
+    def _restore_tool(self, site: SiteKey, entry: CatalogEntry, tool_name: str) -> Optional[ToolVariant]:
+        """Register the tool from the catalog entry for the site, None if the catalog does not have it."""
+        toolinfo = next((f for f in entry.functions if f.get("name") == tool_name), None)
+        if toolinfo is None:
+            return None
+        if not self._registry.has_toolset(entry.digest):
+            # Only the called tool is built, the whole catalog is built again when the tools are listed.
+            return self._registry.register(site, *self._build_tool(toolinfo))
+        self._register_tools(site, entry)
+        return self._registry.lookup(site, tool_name) or self._registry.restore(site, entry.digest, tool_name)
+
+
+    @staticmethod
+    async def _notify_tool_list_changed(session: Any) -> None:
+        """Tell the client to request the list of tools again."""
+        try:
+            await session.send_tool_list_changed()
+        except Exception as e:
+            logger.debug("Could not send tool list changed notification: %s", e)
+
+
+    async def _load_catalog(self, ctx: Context, previous: Optional[CatalogEntry] = None) -> CatalogEntry:
+        """
+        Load the catalog of the site. If the function list reported by the site is the same as in the previous catalog,
+        the previous definitions are returned without contacting the lookup service, otherwise only the definitions of
+        the added or changed functions are requested.
+        """
+        payload, site_version = await self._load_function_list(ctx)
+        listing = hashlib.sha256(json.dumps([payload, site_version], sort_keys=True).encode('utf-8')).hexdigest()
+        if previous is not None and previous.listing == listing:
+            Metrics.count_event("catalog_syncs_total", result="unchanged")
+            return CatalogEntry(previous.functions, listing, previous.fingerprints, previous.digest, previous.extras)
+        functions, fingerprints = await self._prepare_schemas(payload, site_version, previous)
+        names = {self._function_name(item) for item in next(iter(payload.values()))}
+        if not names.issubset(fingerprints):
+            # Some definitions are missing because the lookup service was not available, the next refresh must not skip them.
+            listing = None
+        Metrics.count_event("catalog_syncs_total", result="full" if previous is None else "diff")
+        return CatalogEntry(functions, listing, fingerprints, extras={f.get("name") for f in functions} - names)
+
+
+    async def _load_function_list(self, ctx: Context) -> Tuple[Dict[str, Any], Optional[str]]:
+        """Load the list of available functions from Moodle using available methods."""
+        try:
+            with Metrics.track("catalog", "wsdiscovery"):
+                return await self._load_functions_from_wsdiscovery(ctx)
         except FastMCPError as e1:
             try:
-                return await self._load_functions_from_site_info(ctx)
+                with Metrics.track("catalog", "site_info"):
+                    return await self._load_functions_from_site_info(ctx)
             except FastMCPError as e2:
                 raise FastMCPError(
                     "Unable to load available external functions from your Moodle site. "
@@ -129,32 +420,58 @@ class MoodleMiddleware(Middleware):
                 )
 
 
-    def _register_tools(self, functions: List[Dict[str, Any]]) -> List[Tool]:
-        """Register tools from function definitions."""
-        client_tools: List[Tool] = []
+    def _register_tools(self, site: SiteKey, entry: CatalogEntry) -> List[Tool]:
+        """Register tools from function definitions. Tools are only built when the catalog version is seen for the first time."""
+        return self._registry.register_catalog(site, entry.digest, entry.functions, self._build_tool)
+
 
-        for toolinfo in functions:
-            tool = self._create_tool_from_info(toolinfo)
-            output_schema_hash = self._compute_schema_hash(toolinfo.get("outputSchema"))
+    def _build_tool(self, toolinfo: Dict[str, Any]) -> Tuple[Tool, str]:
+        """Tool of the function definition and the hash of its output schema."""
+        return self._create_tool_from_info(toolinfo), self._compute_schema_hash(toolinfo.get("outputSchema"))
 
-            client_tools.append(tool)
 
-            # Initialize nested dict if needed
-            if tool.name not in self._all_client_tools:
-                self._all_client_tools[tool.name] = {}
+    async def _batch_normalizers(self, site: SiteKey, ctx: Context, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Normalizers for the Moodle functions requested in the batch that are available to the site. Functions that were not
+        registered for the site are restored from its catalog the same way as when they are called directly.
+        """
+        normalizers: Dict[str, Any] = {}
+        calls = arguments.get("calls", [])
+        for call in calls if isinstance(calls, list) else []:
+            name = call.get("wsfunction") if isinstance(call, dict) else None
+            if not isinstance(name, str) or name in ("upload_files", "download_file", "batch_call") or name in normalizers:
+                continue
+            variant = self._registry.lookup(site, name)
+            if variant is None:
+                try:
+                    variant = await self._sync_catalog(site, ctx, name)
+                except FastMCPError:
+                    # Only the calls of the unavailable function fail.
+                    continue
+            normalizers[name] = variant.normalizer
+        return normalizers
 
-            self._all_client_tools[tool.name][output_schema_hash] = tool
 
-        return client_tools
+    def registry_stats(self) -> Dict[str, Any]:
+        """Memory and hit/miss statistics of the tool registry."""
+        return self._registry.stats()
 
 
     def _create_tool_from_info(self, toolinfo: Dict[str, Any]) -> Tool:
         """Create a Tool instance from tool info dictionary."""
-        return Tool(
+        parameters = toolinfo.get("inputSchema")
+        output_schema = toolinfo.get("outputSchema")
+        if toolinfo.get("name") == "download_file" and isinstance(parameters, dict):
+            parameters = {**parameters, "properties": {**parameters.get("properties", {}), **MoodleTool.downloadFileOptions}}
+        elif toolinfo.get("name") not in ("upload_files", "batch_call", "server_stats") and isinstance(parameters, dict):
+            # Moodle functions can return large results, the client can ask only for some fields or for one page.
+            parameters = {**parameters, "properties": {**parameters.get("properties", {}), **ResultProjection.inputOptions}}
+            output_schema = ResultProjection.extend_output_schema(output_schema)
+        return CachedTool(
             name=toolinfo.get("name"),
             description=toolinfo.get("description"),
-            parameters=toolinfo.get("inputSchema"),
-            output_schema=toolinfo.get("outputSchema"),
+            parameters=parameters,
+            output_schema=output_schema,
             icons=[self.icon],
             enabled=True,
         )
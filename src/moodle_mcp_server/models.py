@@ -1,16 +1,21 @@
-from typing import Dict, Optional
+import tempfile
+from typing import Any, Dict, Mapping, Optional
 import mcp.types
-import requests
 from fastmcp.exceptions import ToolError
 from fastmcp.utilities.types import File
 from mcp.types import Annotations
 from typing_extensions import override
+from .settings import Settings
+from .transport import HttpTransport
 
 
 class DownloadedFile(File):
     """Represents a file downloaded from Moodle using the download_file tool."""
 
-    def __init__(self, data: bytes, headers: Dict[str, str]):
+    # Downloaded data is kept in memory up to this size while it is being read, larger files are spooled to disk.
+    spoolSize = 1024 * 1024
+
+    def __init__(self, data: bytes, headers: Mapping[str, str]):
         filename = self._extract_filename(headers)
         name, format = self._parse_filename(filename)
         mime_type = self._extract_mime_type(headers)
@@ -24,7 +29,7 @@ class DownloadedFile(File):
 
 
     @staticmethod
-    def _extract_filename(headers: Dict[str, str]) -> Optional[str]:
+    def _extract_filename(headers: Mapping[str, str]) -> Optional[str]:
         """Extract filename from Content-Disposition header."""
         cd = headers.get("Content-Disposition", "").split(";")
         for part in cd:
@@ -48,7 +53,7 @@ class DownloadedFile(File):
 
 
     @staticmethod
-    def _extract_mime_type(headers: Dict[str, str]) -> Optional[str]:
+    def _extract_mime_type(headers: Mapping[str, str]) -> Optional[str]:
         """Extract MIME type from Content-Type header."""
         mime_type = headers.get("Content-Type")
         if mime_type is not None:
@@ -67,10 +72,95 @@ class DownloadedFile(File):
 
 
     @staticmethod
-    async def request_file(url: str, wstoken: str) -> "DownloadedFile":
-        """Download a file from Moodle using the web service token."""
-        result = requests.post(url, params={"token": wstoken}, allow_redirects=True)
+    def max_size() -> int:
+        """Maximum number of bytes that can be downloaded in one request."""
+        return Settings.get_int("MOODLE_DOWNLOAD_MAX_BYTES", 50 * 1024 * 1024)
+
+
+    @staticmethod
+    async def request_file(url: str, wstoken: str, offset: int = 0, length: Optional[int] = None) -> "DownloadedFile":
+        """
+        Download a file from Moodle using the web service token.
+
+        The response is read in chunks and the download is aborted as soon as it exceeds the maximum size. When offset
+        or length are given, only this part of the file is requested using the Range header (if the server ignores
+        the header, the part is cut out of the full response while it is being read).
+        """
+        maxsize = DownloadedFile.max_size()
+        headers = {}
+        if offset > 0 or length is not None:
+            headers["Range"] = f"bytes={offset}-{offset + length - 1 if length is not None else ''}"
+
+        async with HttpTransport.stream("POST", url, params={"token": wstoken}, headers=headers) as result:
+            if result.status_code not in (200, 206):
+                await result.aread()
+                raise ToolError(f"Error downloading file from URL {url}: {result.status_code} {result.text}")
+
+            skip = offset if result.status_code == 200 else 0
+            remaining = length
+            contentlength = result.headers.get("Content-Length", "")
+            if contentlength.isdigit():
+                expected = max(0, int(contentlength) - skip)
+                expected = expected if remaining is None else min(expected, remaining)
+                if expected > maxsize:
+                    raise ToolError(DownloadedFile._too_large_message(expected, maxsize))
+
+            with tempfile.SpooledTemporaryFile(max_size=DownloadedFile.spoolSize) as spool:
+                size = 0
+                async for chunk in result.aiter_bytes():
+                    if skip > 0:
+                        if len(chunk) <= skip:
+                            skip -= len(chunk)
+                            continue
+                        chunk, skip = chunk[skip:], 0
+                    if remaining is not None:
+                        chunk = chunk[:remaining]
+                        remaining -= len(chunk)
+                    size += len(chunk)
+                    if size > maxsize:
+                        raise ToolError(DownloadedFile._too_large_message(size, maxsize))
+                    spool.write(chunk)
+                    if remaining == 0:
+                        break
+                spool.seek(0)
+                data = spool.read()
+
+        return DownloadedFile(data=data, headers=result.headers)
+
+
+    @staticmethod
+    async def request_metadata(url: str, wstoken: str) -> Dict[str, Any]:
+        """Returns name, type and size of a file in Moodle without downloading its contents."""
+        result = await HttpTransport.request("HEAD", url, params={"token": wstoken})
+        headers = result.headers
         if result.status_code != 200:
-            raise ToolError(f"Error downloading file from URL {url}: {result.status_code} {result.text}")
+            # Not every web server configuration answers HEAD requests, read only the headers of the normal response.
+            async with HttpTransport.stream("POST", url, params={"token": wstoken}) as result:
+                if result.status_code != 200:
+                    await result.aread()
+                    raise ToolError(f"Error downloading file from URL {url}: {result.status_code} {result.text}")
+                headers = result.headers
+
+        return {
+            "filename": DownloadedFile._extract_filename(headers),
+            "mimetype": DownloadedFile._extract_mime_type(headers),
+            "filesize": DownloadedFile._extract_size(headers),
+            "acceptranges": headers.get("Accept-Ranges", "") == "bytes",
+            "maxdownloadsize": DownloadedFile.max_size(),
+        }
+
+
+    @staticmethod
+    def _extract_size(headers: Mapping[str, str]) -> Optional[int]:
+        """Extract full size of the file from Content-Range or Content-Length header."""
+        contentrange = headers.get("Content-Range", "")
+        if "/" in contentrange and contentrange.rsplit("/", maxsplit=1)[1].strip().isdigit():
+            return int(contentrange.rsplit("/", maxsplit=1)[1])
+        contentlength = headers.get("Content-Length", "")
+        return int(contentlength) if contentlength.strip().isdigit() else None
+
 
-        return DownloadedFile(data=result.content, headers=dict(result.headers))
+    @staticmethod
+    def _too_large_message(size: int, maxsize: int) -> str:
+        return (f"The file is too large to download ({size} bytes, the maximum is {maxsize} bytes). "
+                "Use 'offset' and 'length' to download it in parts.")
@@ -0,0 +1,66 @@
+from typing import Any, Callable, Dict, Optional
+
+
+Normalizer = Callable[[Any], Any]
+
+
+class SchemaNormalizer:
+    """
+    Fix PHP JSON encoding quirks where empty objects become empty arrays.
+
+    Since JSON was encoded with PHP, empty objects may appear as empty arrays. This causes schema validation errors.
+    The output schema is compiled once into a function that only visits the paths where an object can appear,
+    fixes the values in place and skips all subtrees that can not need fixing.
+    """
+
+    @staticmethod
+    def compile(schema: Any) -> Optional[Normalizer]:
+        """Compile the schema into a normalizer function, or return None if no value described by the schema can need fixing."""
+        if schema is None or not isinstance(schema, dict) or schema.get("type", None) is None:
+            return None
+
+        if schema["type"] == "array":
+            item_normalizer = SchemaNormalizer.compile(schema.get("items", None))
+            return SchemaNormalizer._array_normalizer(item_normalizer) if item_normalizer is not None else None
+
+        if schema["type"] == "object":
+            properties = schema.get("properties", None)
+            property_normalizers: Dict[str, Normalizer] = {}
+            if isinstance(properties, dict):
+                for key, property_schema in properties.items():
+                    normalizer = SchemaNormalizer.compile(property_schema)
+                    if normalizer is not None:
+                        property_normalizers[key] = normalizer
+            return SchemaNormalizer._object_normalizer(property_normalizers)
+
+        return None
+
+
+    @staticmethod
+    def _array_normalizer(item_normalizer: Normalizer) -> Normalizer:
+        def normalize(value: Any) -> Any:
+            if isinstance(value, list):
+                for index, item in enumerate(value):
+                    fixed = item_normalizer(item)
+                    if fixed is not item:
+                        value[index] = fixed
+            return value
+        return normalize
+
+
+    @staticmethod
+    def _object_normalizer(property_normalizers: Dict[str, Normalizer]) -> Normalizer:
+        items = tuple(property_normalizers.items())
+
+        def normalize(value: Any) -> Any:
+            if isinstance(value, dict):
+                for key, normalizer in items:
+                    if key in value:
+                        item = value[key]
+                        fixed = normalizer(item)
+                        if fixed is not item:
+                            value[key] = fixed
+            elif isinstance(value, list) and len(value) == 0:
+                return {}
+            return value
+        return normalize
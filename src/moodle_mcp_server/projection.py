@@ -0,0 +1,260 @@
+import secrets
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from fastmcp.exceptions import ToolError
+from .catalog import SiteKey
+
+
+class ResultProjection:
+    """
+    Call-time options of the generated tools that make the result smaller before it is serialized and sent to the client:
+    selection of fields (dot-separated paths, arrays are traversed automatically) and limit/offset over the top-level
+    arrays of the result.
+
+    The projection never modifies the result it is given, it builds new containers, because the same result may be
+    shared with other callers (coalesced calls, response cache).
+    """
+
+    # Added to the input schema of every Moodle function tool. Moodle parameter names never start with 'mcp_'.
+    inputOptions: Dict[str, Any] = {
+        "mcp_fields": {
+            "type": "array",
+            "items": {"type": "string"},
+            "description": "Only return these fields of the result, as dot-separated paths relative to the result, "
+                           "for example [\"id\", \"modules.name\"]. Arrays are traversed automatically, '*' matches any field",
+        },
+        "mcp_limit": {
+            "type": "integer",
+            "minimum": 1,
+            "description": "Return at most this number of elements of the top-level arrays of the result. "
+                           "If there are more, the 'pagination' part of the result contains a cursor for the next page",
+        },
+        "mcp_offset": {
+            "type": "integer",
+            "minimum": 0,
+            "description": "Skip this number of elements of the top-level arrays of the result",
+        },
+        "mcp_cursor": {
+            "type": "string",
+            "description": "Return the next page of a previous call, using 'next_cursor' from its result. "
+                           "The function is not called again, other arguments except 'mcp_limit' are ignored",
+        },
+    }
+
+    paginationSchema: Dict[str, Any] = {
+        "type": "object",
+        "description": "Present when the result was paginated with 'mcp_limit' or 'mcp_offset'",
+        "properties": {
+            "offset": {"type": "integer"},
+            "limit": {"type": ["integer", "null"], "description": "Null if only 'mcp_offset' was given"},
+            "total": {"type": "integer", "description": "Number of elements in the longest top-level array"},
+            "next_cursor": {"type": ["string", "null"], "description": "Pass as 'mcp_cursor' to get the next page"},
+        },
+    }
+
+    # Top-level arrays that are never paginated.
+    unpaginated = {"warnings"}
+
+    def __init__(self, fields: Optional[List[str]], limit: Optional[int], offset: int) -> None:
+        self.fields = fields
+        self.limit = limit
+        self.offset = offset
+        self.tree = self.compile_fields(fields) if fields else None
+
+
+    @staticmethod
+    def from_arguments(arguments: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional["ResultProjection"], Optional[str]]:
+        """Split the projection options from the arguments of the function. Returns (arguments, projection or None, cursor or None)."""
+        if not any(key in arguments for key in ResultProjection.inputOptions):
+            return arguments, None, None
+        options = {key: arguments[key] for key in ResultProjection.inputOptions if key in arguments}
+        arguments = {key: value for key, value in arguments.items() if key not in ResultProjection.inputOptions}
+
+        fields = options.get("mcp_fields")
+        if isinstance(fields, str):
+            fields = fields.split(",")
+        if fields is not None and (not isinstance(fields, list) or not all(isinstance(f, str) for f in fields)):
+            raise ToolError("Argument 'mcp_fields' must be a list of strings")
+        limit = ResultProjection._int_option(options, "mcp_limit", 1)
+        offset = ResultProjection._int_option(options, "mcp_offset", 0) or 0
+        cursor = options.get("mcp_cursor")
+        if cursor is not None and not isinstance(cursor, str):
+            raise ToolError("Argument 'mcp_cursor' must be a string")
+        projection = ResultProjection([f.strip() for f in fields if f.strip()] if fields else None, limit, offset)
+        return arguments, projection, cursor or None
+
+
+    @staticmethod
+    def _int_option(options: Dict[str, Any], key: str, minimum: int) -> Optional[int]:
+        value = options.get(key)
+        if value is None:
+            return None
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise ToolError(f"Argument '{key}' must be an integer")
+        if value < minimum:
+            raise ToolError(f"Argument '{key}' must be at least {minimum}")
+        return value
+
+
+    @staticmethod
+    def extend_output_schema(schema: Any) -> Any:
+        """
+        Output schema of a function tool with the pagination info. Fields inside the result are no longer required,
+        because they can be left out with 'mcp_fields'.
+        """
+        if not isinstance(schema, dict) or not isinstance(schema.get("properties"), dict):
+            return schema
+        properties = {**schema["properties"], "pagination": ResultProjection.paginationSchema}
+        if "result" in properties:
+            properties["result"] = ResultProjection._relax(properties["result"])
+        return {**schema, "properties": properties}
+
+
+    @staticmethod
+    def _relax(schema: Any) -> Any:
+        if isinstance(schema, list):
+            return [ResultProjection._relax(item) for item in schema]
+        if not isinstance(schema, dict):
+            return schema
+        return {key: ResultProjection._relax(value) for key, value in schema.items() if not (key == "required" and isinstance(value, list))}
+
+
+    @staticmethod
+    def compile_fields(fields: List[str]) -> Dict[str, Any]:
+        """Compile the paths into a tree: field => subtree, None means the whole value of the field is included."""
+        tree: Dict[str, Any] = {}
+        for path in fields:
+            parts = [part for part in path.replace("[*]", "").replace("[]", "").removeprefix("$").split(".") if part]
+            node = tree
+            for index, part in enumerate(parts):
+                if index == len(parts) - 1:
+                    node[part] = None
+                    break
+                child = node.get(part, {})
+                if child is None:
+                    # A shorter path already includes the whole value.
+                    break
+                node = node.setdefault(part, child)
+        return tree
+
+
+    @staticmethod
+    def project(value: Any, tree: Optional[Dict[str, Any]]) -> Any:
+        """New value with only the fields from the tree. Arrays are projected element by element."""
+        if tree is None:
+            return value
+        if isinstance(value, list):
+            return [ResultProjection.project(item, tree) for item in value]
+        if not isinstance(value, dict):
+            return value
+        projected: Dict[str, Any] = {}
+        wildcard = tree.get("*", False)
+        for key, item in value.items():
+            subtree = tree.get(key, wildcard)
+            if subtree is not False:
+                projected[key] = ResultProjection.project(item, subtree)
+        return projected
+
+
+    def paginate(self, result: Any, offset: int, limit: Optional[int]) -> Tuple[Any, int]:
+        """Slice the top-level arrays of the result. Returns the page and the length of the longest array."""
+        end = offset + limit if limit is not None else None
+        if isinstance(result, list):
+            return result[offset:end], len(result)
+        if isinstance(result, dict):
+            total = 0
+            page: Dict[str, Any] = {}
+            for key, value in result.items():
+                if isinstance(value, list) and key not in self.unpaginated:
+                    total = max(total, len(value))
+                    page[key] = value[offset:end]
+                else:
+                    page[key] = value
+            return page, total
+        return result, 0
+
+
+    @property
+    def paginates(self) -> bool:
+        return self.limit is not None or self.offset > 0
+
+
+    def apply(self, result: Any, offset: Optional[int] = None) -> Tuple[Any, Optional[Dict[str, Any]]]:
+        """Paginate and project the result. Returns the new result and the pagination info (None if not paginated)."""
+        offset = self.offset if offset is None else offset
+        pagination = None
+        if self.paginates:
+            result, total = self.paginate(result, offset, self.limit)
+            pagination = {"offset": offset, "limit": self.limit, "total": total, "next_cursor": None}
+        return self.project(result, self.tree), pagination
+
+
+class ResultPages:
+    """
+    Short-lived store of full results that were paginated, so that the next page can be returned for a cursor
+    without calling Moodle again. Entries expire after the TTL, the least recently stored ones are dropped
+    when there are too many.
+    """
+
+    def __init__(self, ttl: float, max_entries: int) -> None:
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        # Id => (site, function, full result, projection, expiry time).
+        self._entries: OrderedDict[str, Tuple[SiteKey, str, Any, ResultProjection, float]] = OrderedDict()
+
+
+    def paginate(self, site: SiteKey, name: str, result: Any, projection: ResultProjection) -> Dict[str, Any]:
+        """Structured content with the requested page of the result and a cursor if there are more elements."""
+        page, pagination = projection.apply(result)
+        if pagination is not None:
+            self._set_cursor(site, name, result, projection, pagination)
+            return {"result": page, "pagination": pagination}
+        return {"result": page}
+
+
+    def resume(self, site: SiteKey, name: str, cursor: str, limit: Optional[int]) -> Dict[str, Any]:
+        """Structured content with the page of a stored result that the cursor points to."""
+        self._expire()
+        entryid, _, offset = cursor.partition(":")
+        entry = self._entries.get(entryid)
+        if entry is None or entry[0] != site or entry[1] != name or not offset.isdigit():
+            raise ToolError("The cursor is not valid or has expired. Call the function again without 'mcp_cursor'.")
+        _, _, result, projection, _ = entry
+        if limit is not None and limit != projection.limit:
+            projection = ResultProjection(projection.fields, limit, projection.offset)
+        page, pagination = projection.apply(result, int(offset))
+        if pagination is not None:
+            self._set_cursor(site, name, result, projection, pagination, entryid)
+        return {"result": page, "pagination": pagination}
+
+
+    def _set_cursor(self, site: SiteKey, name: str, result: Any, projection: ResultProjection,
+                    pagination: Dict[str, Any], entryid: Optional[str] = None) -> None:
+        limit = pagination["limit"]
+        if limit is None or self.ttl <= 0 or pagination["offset"] + limit >= pagination["total"]:
+            return
+        if entryid is None:
+            entryid = secrets.token_urlsafe(12)
+        self._entries[entryid] = (site, name, result, projection, time.monotonic() + self.ttl)
+        self._entries.move_to_end(entryid)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        pagination["next_cursor"] = f"{entryid}:{pagination['offset'] + limit}"
+
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        for entryid in [k for k, entry in self._entries.items() if entry[4] < now]:
+            del self._entries[entryid]
+
+
+    def forget_site(self, site: SiteKey) -> None:
+        for entryid in [k for k, entry in self._entries.items() if entry[0] == site]:
+            del self._entries[entryid]
+
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries)}
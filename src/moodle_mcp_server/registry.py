@@ -0,0 +1,222 @@
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from fastmcp.tools.tool import Tool
+from mcp.types import Tool as MCPTool
+from pydantic import PrivateAttr
+from typing_extensions import override
+from .catalog import SiteKey
+from .normalizer import Normalizer, SchemaNormalizer
+
+
+class CachedTool(Tool):
+    """Tool that is converted to the MCP representation only once, the same tools are listed on every tools/list request."""
+
+    _mcp_tools: Dict[Any, MCPTool] = PrivateAttr(default_factory=dict)
+
+    @override
+    def to_mcp_tool(self, *, include_fastmcp_meta: Optional[bool] = None, **overrides: Any) -> MCPTool:
+        key = (include_fastmcp_meta, tuple(sorted(overrides.items())))
+        try:
+            mcp_tool = self._mcp_tools.get(key)
+        except TypeError:
+            # Unhashable overrides.
+            return super().to_mcp_tool(include_fastmcp_meta=include_fastmcp_meta, **overrides)
+        if mcp_tool is None:
+            mcp_tool = self._mcp_tools[key] = super().to_mcp_tool(include_fastmcp_meta=include_fastmcp_meta, **overrides)
+        return mcp_tool
+
+
+class ToolVariant:
+    """Tool as it was listed to a site, with the output normalizer compiled from its output schema."""
+
+    def __init__(self, tool: Tool, schema_hash: str, normalizer: Optional[Normalizer]) -> None:
+        self.tool = tool
+        self.schema_hash = schema_hash
+        self.normalizer = normalizer
+
+
+class ToolRegistry:
+    """
+    Registry of the tools that were listed to the clients, used to find the output schema at call time.
+
+    Different sites (or versions of the same site) may return different output schemas for the same function.
+    Each distinct schema is a variant of the tool. Identical schemas are interned and shared between variants,
+    the number of variants per tool is bounded (least recently used ones are evicted), and for each site
+    the registry remembers which variant it was given.
+    """
+
+    def __init__(self, max_variants: int = 8, max_toolsets: int = 16) -> None:
+        self.max_variants = max(1, max_variants)
+        self.max_toolsets = max(1, max_toolsets)
+        self._variants: Dict[str, OrderedDict[str, ToolVariant]] = {}
+        self._site_variants: Dict[SiteKey, Dict[str, str]] = {}
+        # Version of the catalog (digest of the function definitions) registered for each site.
+        self._site_versions: Dict[SiteKey, str] = {}
+        # Tools built for each catalog version, shared by all sites with the same catalog: version => [(tool, schema hash, definition hash)].
+        self._toolsets: OrderedDict[str, List[Tuple[Tool, str, str]]] = OrderedDict()
+        # Tools of the cached toolsets by the hash of their definition: hash => [tool, schema hash, number of toolsets using it].
+        self._definitions: Dict[str, list] = {}
+        # Interned output schemas: hash => [schema, size in bytes, number of variants using it, compiled normalizer].
+        self._schemas: Dict[str, list] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def register_catalog(self, site: SiteKey, version: str, functions: List[Dict[str, Any]],
+                         build: Callable[[Dict[str, Any]], Tuple[Tool, str]]) -> List[Tool]:
+        """
+        Tools of the catalog version, registered for the site.
+
+        The tools are built only once per catalog version and registered again only when the version of the site changes,
+        so listing the tools of an unchanged catalog does not create any objects. When a new version is built, the tools
+        of the definitions that did not change are taken from the other cached versions.
+        """
+        toolset = self._toolsets.get(version)
+        if toolset is None:
+            toolset = [self._build(site, toolinfo, build) for toolinfo in functions]
+            self._toolsets[version] = toolset
+            while len(self._toolsets) > self.max_toolsets:
+                _, evicted = self._toolsets.popitem(last=False)
+                for _, _, definition_hash in evicted:
+                    self._release_definition(definition_hash)
+        else:
+            self._toolsets.move_to_end(version)
+            if self._site_versions.get(site) != version:
+                for tool, schema_hash, _ in toolset:
+                    self.register(site, tool, schema_hash)
+        self._site_versions[site] = version
+        return [tool for tool, _, _ in toolset]
+
+
+    def has_toolset(self, version: str) -> bool:
+        """Whether the tools of the catalog version are cached."""
+        return version in self._toolsets
+
+
+    def register(self, site: SiteKey, tool: Tool, schema_hash: str) -> ToolVariant:
+        """Remember the tool variant that was listed to the site."""
+        variants = self._variants.setdefault(tool.name, OrderedDict())
+        if schema_hash in variants:
+            variants.move_to_end(schema_hash)
+        else:
+            variants[schema_hash] = self._intern(tool, schema_hash)
+            while len(variants) > self.max_variants:
+                evicted_hash, _ = variants.popitem(last=False)
+                self._release(evicted_hash)
+                self.evictions += 1
+        self._site_variants.setdefault(site, {})[tool.name] = schema_hash
+        return variants[schema_hash]
+
+
+    def restore(self, site: SiteKey, version: str, name: str) -> Optional[ToolVariant]:
+        """Register the tool of the catalog version for the site again, after its variant was evicted. None if the catalog has no such tool."""
+        for tool, schema_hash, _ in self._toolsets.get(version, []):
+            if tool.name == name:
+                return self.register(site, tool, schema_hash)
+        return None
+
+
+    def lookup(self, site: SiteKey, name: str) -> Optional[ToolVariant]:
+        """Return the variant of the tool that was listed to the site, or None if the site was never given this tool (or it was evicted)."""
+        schema_hash = self._site_variants.get(site, {}).get(name)
+        variants = self._variants.get(name)
+        if schema_hash is None or variants is None or schema_hash not in variants:
+            self.misses += 1
+            return None
+        self.hits += 1
+        variants.move_to_end(schema_hash)
+        return variants[schema_hash]
+
+
+    def has_tool(self, name: str) -> bool:
+        """Whether a tool with the name was listed to any site."""
+        return name in self._variants
+
+
+    def forget_site(self, site: SiteKey) -> None:
+        """Drop the mapping of tools for the site and the variants that no other site uses."""
+        self._site_versions.pop(site, None)
+        forgotten = self._site_variants.pop(site, None)
+        if not forgotten:
+            return
+        used = {(name, schema_hash) for mapping in self._site_variants.values() for name, schema_hash in mapping.items()}
+        for name, schema_hash in forgotten.items():
+            variants = self._variants.get(name)
+            if variants is None or schema_hash not in variants or (name, schema_hash) in used:
+                continue
+            del variants[schema_hash]
+            self._release(schema_hash)
+            if not variants:
+                del self._variants[name]
+
+
+    def stats(self) -> Dict[str, Any]:
+        """Size of the registry and its hit/miss counters."""
+        return {
+            "tools": len(self._variants),
+            "variants": sum(len(v) for v in self._variants.values()),
+            "schemas": len(self._schemas),
+            "schema_bytes": sum(entry[1] for entry in self._schemas.values()),
+            "sites": len(self._site_variants),
+            "toolsets": len(self._toolsets),
+            "definitions": len(self._definitions),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+    def _build(self, site: SiteKey, toolinfo: Dict[str, Any], build: Callable[[Dict[str, Any]], Tuple[Tool, str]]) -> Tuple[Tool, str, str]:
+        """Tool of the definition registered for the site, built only if no cached toolset has the identical definition."""
+        definition_hash = hashlib.sha256(json.dumps(toolinfo, sort_keys=True).encode('utf-8')).hexdigest()
+        entry = self._definitions.get(definition_hash)
+        if entry is None:
+            tool, schema_hash = build(toolinfo)
+            # The variant may be an earlier tool with the same output schema, only the schema object is taken from it.
+            tool = self._with_schema(tool, self.register(site, tool, schema_hash).tool.output_schema)
+            entry = self._definitions[definition_hash] = [tool, schema_hash, 0]
+        else:
+            self.register(site, entry[0], entry[1])
+        entry[2] += 1
+        return entry[0], entry[1], definition_hash
+
+
+    def _release_definition(self, definition_hash: str) -> None:
+        entry = self._definitions.get(definition_hash)
+        if entry is not None:
+            entry[2] -= 1
+            if entry[2] <= 0:
+                del self._definitions[definition_hash]
+
+
+    def _intern(self, tool: Tool, schema_hash: str) -> ToolVariant:
+        """Make the tool share the output schema object and its compiled normalizer with all other variants that have the identical schema."""
+        entry = self._schemas.get(schema_hash)
+        if entry is None:
+            schema = tool.output_schema
+            entry = [schema, len(json.dumps(schema)), 0, SchemaNormalizer.compile(schema)]
+            self._schemas[schema_hash] = entry
+        entry[2] += 1
+        return ToolVariant(self._with_schema(tool, entry[0]), schema_hash, entry[3])
+
+
+    @staticmethod
+    def _with_schema(tool: Tool, schema: Optional[Dict[str, Any]]) -> Tool:
+        """The tool with the given (identical) output schema object."""
+        if tool.output_schema is schema:
+            return tool
+        tool = tool.model_copy(update={"output_schema": schema})
+        if isinstance(tool, CachedTool):
+            tool._mcp_tools = {}
+        return tool
+
+
+    def _release(self, schema_hash: str) -> None:
+        entry = self._schemas.get(schema_hash)
+        if entry is not None:
+            entry[2] -= 1
+            if entry[2] <= 0:
+                del self._schemas[schema_hash]
@@ -0,0 +1,199 @@
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+import httpx
+from fastmcp.exceptions import FastMCPError
+from .metrics import Metrics
+from .settings import Settings
+
+
+class TokenBucket:
+    """Rate limiter allowing on average 'rate' requests per second with bursts of up to 'burst' requests."""
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class CircuitBreaker:
+    """
+    Fails requests fast while the site is unhealthy.
+
+    After 'threshold' consecutive failures (network errors or 5xx responses) the circuit opens and requests are
+    rejected for 'reset_timeout' seconds. Then one trial request is let through: if it succeeds the circuit closes,
+    otherwise it opens again. Threshold of zero disables the breaker.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float) -> None:
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+
+    def before_request(self, site: str) -> None:
+        if self._opened_at is None:
+            return
+        remaining = self._opened_at + self.reset_timeout - time.monotonic()
+        if remaining > 0 or self._probing:
+            raise FastMCPError(f"The site {site} is not responding, requests to it are paused for "
+                               f"{max(1, round(remaining))} seconds after {self.failures} consecutive failures.")
+        self._probing = True
+
+
+    def record(self, success: bool) -> None:
+        self._probing = False
+        if success:
+            self.failures = 0
+            self._opened_at = None
+            return
+        self.failures += 1
+        if self.threshold > 0 and (self.failures >= self.threshold or self._opened_at is not None):
+            if self._opened_at is None:
+                Metrics.inc("circuit_opened_total")
+            self._opened_at = time.monotonic()
+
+
+    def abort(self) -> None:
+        """The request was cancelled without an outcome, let another one try."""
+        self._probing = False
+
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+
+class SiteGuard:
+    """Concurrency limiter, rate limiter and circuit breaker of one site."""
+
+    def __init__(self) -> None:
+        concurrency = Settings.get_int("MOODLE_SITE_CONCURRENCY", 10)
+        self.semaphore = asyncio.Semaphore(concurrency) if concurrency > 0 else None
+        rate = Settings.get_float("MOODLE_SITE_RATE", 0)
+        self.bucket = TokenBucket(rate, Settings.get_float("MOODLE_SITE_BURST", max(1.0, rate)))
+        self.breaker = CircuitBreaker(Settings.get_int("MOODLE_CIRCUIT_FAILURES", 5), Settings.get_float("MOODLE_CIRCUIT_RESET", 30))
+
+
+    @asynccontextmanager
+    async def slot(self, site: str) -> AsyncIterator[None]:
+        """Wait for a free slot and a token, or fail fast if the circuit is open."""
+        self.breaker.before_request(site)
+        try:
+            if self.semaphore is None:
+                await self.bucket.acquire()
+                yield
+            else:
+                async with self.semaphore:
+                    await self.bucket.acquire()
+                    yield
+        except BaseException:
+            self.breaker.abort()
+            raise
+
+
+class Resilience:
+    """
+    Protection of the upstream calls: per-site concurrency and rate limits, circuit breaker and retries
+    with jittered exponential backoff.
+
+    Only idempotent requests are retried after the request may have reached the server (read timeouts,
+    429 and 502-504 responses). Failures to connect are retried for all requests with a replayable body,
+    because nothing was sent yet.
+    """
+
+    retryStatuses = {429, 502, 503, 504}
+    connectErrors = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+    _guards: Dict[str, SiteGuard] = {}
+
+
+    @staticmethod
+    def guard(site: str) -> SiteGuard:
+        guard = Resilience._guards.get(site)
+        if guard is None:
+            guard = Resilience._guards[site] = SiteGuard()
+        return guard
+
+
+    @staticmethod
+    def forget(site: str) -> None:
+        Resilience._guards.pop(site, None)
+
+
+    @staticmethod
+    def backoff(attempt: int) -> float:
+        """Full jitter: a random delay between zero and the exponentially growing limit."""
+        base = Settings.get_float("MOODLE_RETRY_BACKOFF", 0.5)
+        cap = Settings.get_float("MOODLE_RETRY_MAX_BACKOFF", 10)
+        return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+    @staticmethod
+    def _retry_after(response: httpx.Response) -> Optional[float]:
+        value = response.headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+    @staticmethod
+    async def call(site: str, send: Callable[[], Awaitable[httpx.Response]], idempotent: bool, replayable: bool = True) -> httpx.Response:
+        """Send the request through the site guard, retrying it when it is safe."""
+        guard = Resilience.guard(site)
+        retries = max(0, Settings.get_int("MOODLE_RETRIES", 2)) if replayable else 0
+        attempt = 0
+        while True:
+            delay: Optional[float] = None
+            async with guard.slot(site):
+                try:
+                    response = await send()
+                except httpx.TransportError as e:
+                    guard.breaker.record(False)
+                    if attempt >= retries or not (idempotent or isinstance(e, Resilience.connectErrors)):
+                        raise
+                    Metrics.count_event("retries_total", reason=type(e).__name__)
+                else:
+                    guard.breaker.record(response.status_code < 500)
+                    if attempt >= retries or not idempotent or response.status_code not in Resilience.retryStatuses:
+                        return response
+                    Metrics.count_event("retries_total", reason=str(response.status_code))
+                    delay = Resilience._retry_after(response)
+                    await response.aclose()
+            maxdelay = Settings.get_float("MOODLE_RETRY_MAX_BACKOFF", 10)
+            await asyncio.sleep(min(delay, maxdelay) if delay is not None else Resilience.backoff(attempt))
+            attempt += 1
+
+
+    @staticmethod
+    def stats() -> Dict[str, int]:
+        return {
+            "sites": len(Resilience._guards),
+            "open_circuits": sum(1 for guard in Resilience._guards.values() if guard.breaker.is_open),
+        }
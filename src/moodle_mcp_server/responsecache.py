@@ -0,0 +1,160 @@
+import hashlib
+import json
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from .settings import Settings
+
+
+class ResponseCache:
+    """
+    Read-through cache of the results of read-only web service functions.
+
+    The cache is opt-in (MOODLE_RESPONSE_CACHE=1). Functions are classified as read-only by name (get/search functions)
+    or by the allowlist. Entries are keyed by the site, token fingerprint, function and normalized arguments, expire
+    after a per-function TTL and are evicted in least recently used order when the total size, or the size of the
+    entries of one site, exceeds the limit.
+    Calling any other (write) function drops the cached entries of the same component for the site.
+    """
+
+    readOnlyPattern = re.compile(r"_(get|search)_")
+
+    # Functions that look read-only but return a different result on every call.
+    neverCache = {
+        "core_files_get_unused_draft_itemid",
+        "tool_mobile_get_autologin_key",
+        "core_course_get_updates_since",
+        "core_message_get_unread_conversations_count",
+    }
+
+    def __init__(self) -> None:
+        self.enabled = Settings.get_bool("MOODLE_RESPONSE_CACHE", False)
+        self.max_bytes = Settings.get_int("MOODLE_RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+        self.max_bytes_per_site = Settings.get_int("MOODLE_RESPONSE_CACHE_SITE_MAX_BYTES", 16 * 1024 * 1024)
+        self.default_ttl = Settings.get_float("MOODLE_RESPONSE_CACHE_TTL", 60)
+        self.ttls = self._parse_ttls(Settings.get_str("MOODLE_RESPONSE_CACHE_TTLS"))
+        self.allowed = self._parse_list(Settings.get_str("MOODLE_RESPONSE_CACHE_FUNCTIONS"))
+        self.excluded = self.neverCache | self._parse_list(Settings.get_str("MOODLE_RESPONSE_CACHE_EXCLUDE"))
+        # Key => (serialized result, size, expiry time, site, component).
+        self._entries: OrderedDict[str, Tuple[str, int, float, Tuple[str, str], str]] = OrderedDict()
+        self.size = 0
+        self._site_sizes: Dict[Tuple[str, str], int] = {}
+        self.hits = 0
+        self.misses = 0
+
+
+    @staticmethod
+    def _parse_list(value: str) -> set:
+        return {item.strip() for item in value.split(",") if item.strip()}
+
+
+    @staticmethod
+    def _parse_ttls(value: str) -> Dict[str, float]:
+        """Parse per-function TTLs in the format 'function=seconds,function=seconds'."""
+        ttls: Dict[str, float] = {}
+        for item in ResponseCache._parse_list(value):
+            name, _, seconds = item.partition("=")
+            try:
+                ttls[name.strip()] = float(seconds)
+            except ValueError:
+                pass
+        return ttls
+
+
+    @staticmethod
+    def component(name: str) -> str:
+        """Frankenstyle component of the function, for example 'core_course' or 'mod_assign'."""
+        return "_".join(name.split("_")[:2])
+
+
+    def is_read_only(self, name: str) -> bool:
+        if name in self.excluded:
+            return False
+        return name in self.allowed or self.readOnlyPattern.search(name) is not None
+
+
+    def ttl(self, name: str) -> float:
+        return self.ttls.get(name, self.default_ttl)
+
+
+    def caches(self, name: str) -> bool:
+        """Whether results of the function are stored in the cache."""
+        return self.enabled and self.is_read_only(name) and self.ttl(name) > 0
+
+
+    def key(self, site: Tuple[str, str], name: str, arguments: Dict[str, Any]) -> Optional[str]:
+        """Cache key for the call, or None if the result of this function can not be cached."""
+        if not self.caches(name):
+            return None
+        return self.call_key(site, name, arguments)
+
+
+    @staticmethod
+    def call_key(site: Tuple[str, str], name: str, arguments: Dict[str, Any]) -> str:
+        """Identifier of the call: site, token fingerprint, function and normalized arguments."""
+        normalized = json.dumps([site, name, arguments], sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return a copy of the cached result, or None if it is not cached or expired."""
+        entry = self._entries.get(key)
+        if entry is None or entry[2] < time.monotonic():
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return json.loads(entry[0])
+
+
+    def put(self, key: str, site: Tuple[str, str], name: str, result: Any) -> None:
+        serialized = json.dumps(result, separators=(",", ":"))
+        size = len(serialized)
+        if size > min(self.max_bytes, self.max_bytes_per_site):
+            return
+        self._remove(key)
+        self._entries[key] = (serialized, size, time.monotonic() + self.ttl(name), site, self.component(name))
+        self.size += size
+        self._site_sizes[site] = self._site_sizes.get(site, 0) + size
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+        if self._site_sizes.get(site, 0) > self.max_bytes_per_site:
+            for oldest in [k for k, entry in self._entries.items() if entry[3] == site]:
+                self._remove(oldest)
+                if self._site_sizes.get(site, 0) <= self.max_bytes_per_site:
+                    break
+
+
+    def invalidate(self, site: Tuple[str, str], name: str) -> None:
+        """Drop cached results of the functions from the same component, called when a write function was executed."""
+        if not self._entries:
+            return
+        component = self.component(name)
+        stale: List[str] = [key for key, entry in self._entries.items() if entry[3] == site and entry[4] == component]
+        for key in stale:
+            self._remove(key)
+
+
+    def forget_site(self, site: Tuple[str, str]) -> None:
+        """Drop all cached results of the site."""
+        if self._site_sizes.get(site):
+            for key in [key for key, entry in self._entries.items() if entry[3] == site]:
+                self._remove(key)
+
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+            remaining = self._site_sizes.get(entry[3], 0) - entry[1]
+            if remaining > 0:
+                self._site_sizes[entry[3]] = remaining
+            else:
+                self._site_sizes.pop(entry[3], None)
+
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "bytes": self.size, "sites": len(self._site_sizes), "hits": self.hits, "misses": self.misses}
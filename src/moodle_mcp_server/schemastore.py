@@ -0,0 +1,164 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from .settings import Settings
+
+
+logger = logging.getLogger(__name__)
+
+# Key under which a schema is stored: function name and fingerprint of its version on the site.
+SchemaKey = Tuple[str, str]
+
+
+class SchemaStore:
+    """
+    Persistent cache of the function schemas received from the MCP Ready lookup service.
+
+    Schemas are stored in an SQLite database under the cache directory, keyed by function name and a
+    fingerprint of the function version, so that several server processes can share it and the lookup
+    service only needs to be asked about functions that were not seen before. The methods block while the database
+    is locked by another process, they are meant to be called from a worker thread; errors are logged and the store
+    behaves as empty.
+    """
+
+    # Fingerprint used for helper tools that the lookup service returns in addition to the requested functions.
+    EXTRA = ""
+
+    # How long to remember that the lookup service does not know a function, before asking again.
+    NEGATIVE_TTL = 86400
+
+    def __init__(self, path: Optional[str]) -> None:
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        # The connection is shared by the worker threads, one statement or transaction at a time.
+        self._lock = threading.Lock()
+
+
+    @staticmethod
+    def default_path() -> Optional[str]:
+        """Location of the schema database, or None if the persistent cache is disabled."""
+        if not Settings.get_bool("MOODLE_SCHEMA_CACHE", True):
+            return None
+        cachedir = Settings.get_str("MOODLE_MCP_CACHE_DIR") or os.path.join(
+            Settings.get_str("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+            "moodle-mcp-server")
+        return os.path.join(cachedir, "schemas.sqlite3")
+
+
+    @staticmethod
+    def fingerprint(item: Any, site_version: Optional[str] = None) -> str:
+        """Fingerprint of a function as reported by the site (full definition or name with component version)."""
+        payload = json.dumps({"site": site_version, "function": item}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        if self._connection is None and self.path is not None:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                connection = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS schemas ("
+                    "name TEXT NOT NULL, fingerprint TEXT NOT NULL, definition TEXT, updated REAL NOT NULL, "
+                    "PRIMARY KEY (name, fingerprint))")
+                self._connection = connection
+            except (OSError, sqlite3.Error) as e:
+                logger.warning("Schema cache %s is not available: %s", self.path, e)
+                self.path = None
+        return self._connection
+
+
+    def get_many(self, keys: Iterable[SchemaKey]) -> Dict[SchemaKey, Optional[Dict[str, Any]]]:
+        """
+        Return stored schemas for the given keys. Keys that are missing from the store are not present in the result,
+        functions that are known to be absent in the lookup service map to None.
+        """
+        keys = list(keys)
+        if not keys:
+            return {}
+        wanted = set(keys)
+        result: Dict[SchemaKey, Optional[Dict[str, Any]]] = {}
+        expired = time.time() - self.NEGATIVE_TTL
+        names = sorted({name for name, _ in keys})
+        with self._lock:
+            connection = self._connect()
+            if connection is None:
+                return {}
+            try:
+                for offset in range(0, len(names), 500):
+                    chunk = names[offset:offset + 500]
+                    rows = connection.execute(
+                        f"SELECT name, fingerprint, definition, updated FROM schemas WHERE name IN ({','.join('?' * len(chunk))})",
+                        chunk).fetchall()
+                    for name, fingerprint, definition, updated in rows:
+                        if (name, fingerprint) not in wanted:
+                            continue
+                        if definition is None and updated < expired:
+                            continue
+                        result[(name, fingerprint)] = json.loads(definition) if definition is not None else None
+            except sqlite3.Error as e:
+                logger.warning("Could not read from the schema cache %s: %s", self.path, e)
+                return {}
+        return result
+
+
+    def get_extras(self) -> List[Dict[str, Any]]:
+        """Helper tools that the lookup service returned in addition to the requested functions."""
+        with self._lock:
+            connection = self._connect()
+            if connection is None:
+                return []
+            try:
+                rows = connection.execute(
+                    "SELECT definition FROM schemas WHERE fingerprint = ? AND definition IS NOT NULL ORDER BY name", (self.EXTRA,)).fetchall()
+            except sqlite3.Error as e:
+                logger.warning("Could not read from the schema cache %s: %s", self.path, e)
+                return []
+        return [json.loads(definition) for definition, in rows]
+
+
+    def get_latest(self, names: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Most recently stored schema for each function name regardless of the version, used when the lookup service is unreachable."""
+        names = sorted(set(names))
+        if not names:
+            return {}
+        result: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            connection = self._connect()
+            if connection is None:
+                return {}
+            try:
+                for offset in range(0, len(names), 500):
+                    chunk = names[offset:offset + 500]
+                    rows = connection.execute(
+                        f"SELECT name, definition FROM schemas WHERE definition IS NOT NULL AND name IN ({','.join('?' * len(chunk))}) "
+                        "ORDER BY updated",
+                        chunk).fetchall()
+                    for name, definition in rows:
+                        result[name] = json.loads(definition)
+            except sqlite3.Error as e:
+                logger.warning("Could not read from the schema cache %s: %s", self.path, e)
+                return {}
+        return result
+
+
+    def put_many(self, items: Iterable[Tuple[str, str, Optional[Dict[str, Any]]]]) -> None:
+        """Store schemas as (name, fingerprint, definition) tuples. Definition None means the lookup service does not know the function."""
+        now = time.time()
+        rows = [(name, fingerprint, json.dumps(definition) if definition is not None else None, now)
+                for name, fingerprint, definition in items]
+        with self._lock:
+            connection = self._connect()
+            if connection is None:
+                return
+            try:
+                with connection:
+                    connection.executemany("INSERT OR REPLACE INTO schemas (name, fingerprint, definition, updated) VALUES (?, ?, ?, ?)", rows)
+            except sqlite3.Error as e:
+                logger.warning("Could not write to the schema cache %s: %s", self.path, e)
@@ -0,0 +1,32 @@
+import os
+
+
+class Settings:
+    """Access to optional configuration from environment variables."""
+
+    @staticmethod
+    def get_str(name: str, default: str = "") -> str:
+        return os.environ.get(name, "").strip() or default
+
+
+    @staticmethod
+    def get_float(name: str, default: float) -> float:
+        try:
+            return float(Settings.get_str(name) or default)
+        except ValueError:
+            return default
+
+
+    @staticmethod
+    def get_int(name: str, default: int) -> int:
+        return int(Settings.get_float(name, default))
+
+
+    @staticmethod
+    def get_bool(name: str, default: bool) -> bool:
+        value = Settings.get_str(name).lower()
+        if value in ("1", "true", "yes", "on"):
+            return True
+        if value in ("0", "false", "no", "off"):
+            return False
+        return default
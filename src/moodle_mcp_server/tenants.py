@@ -0,0 +1,57 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List
+from .catalog import SiteKey
+
+
+class TenantTracker:
+    """
+    Tracks when each site (tenant) was last used, so that the state kept for idle sites can be evicted.
+
+    In the multi-tenant HTTP mode one server process serves many Moodle sites. Sites that were not used for
+    longer than the idle TTL, or the least recently used ones above the maximum number of sites, are returned
+    from touch() and the caller drops their tool registry entries, caches and connection pools.
+    """
+
+    def __init__(self, idle_ttl: float, max_tenants: int) -> None:
+        self.idle_ttl = idle_ttl
+        self.max_tenants = max(1, max_tenants)
+        self._last_used: OrderedDict[SiteKey, float] = OrderedDict()
+        self._next_check = 0.0
+        self.evictions = 0
+
+
+    def touch(self, site: SiteKey) -> List[SiteKey]:
+        """Mark the site as used now, return the sites that should be evicted."""
+        now = time.monotonic()
+        self._last_used[site] = now
+        self._last_used.move_to_end(site)
+
+        evicted: List[SiteKey] = []
+        while len(self._last_used) > self.max_tenants:
+            evicted.append(self._last_used.popitem(last=False)[0])
+
+        if self.idle_ttl > 0 and now >= self._next_check:
+            # Checking for idle sites at most a few times per TTL is enough, there is no need to do it on every request.
+            self._next_check = now + min(60.0, self.idle_ttl / 4)
+            while self._last_used:
+                oldest, used = next(iter(self._last_used.items()))
+                if now - used < self.idle_ttl:
+                    break
+                del self._last_used[oldest]
+                evicted.append(oldest)
+
+        self.evictions += len(evicted)
+        return evicted
+
+
+    def is_active(self, site: SiteKey) -> bool:
+        return site in self._last_used
+
+
+    def sites(self) -> List[SiteKey]:
+        return list(self._last_used.keys())
+
+
+    def stats(self) -> Dict[str, Any]:
+        return {"sites": len(self._last_used), "evictions": self.evictions}
@@ -1,107 +1,411 @@
+import asyncio
 import base64
-from typing import Any, Dict, List
-from urllib.parse import urlencode
-import requests
+import json
+import re
+import tempfile
+from typing import IO, Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote_plus, urljoin, urlparse
 from fastmcp.exceptions import ToolError
-from fastmcp.tools.tool import Tool, ToolResult
+from fastmcp.tools.tool import ToolResult
 from .models import DownloadedFile
+from .metrics import Metrics
+from .normalizer import Normalizer
+from .projection import ResultProjection
+from .responsecache import ResponseCache
+from .settings import Settings
+from .singleflight import SingleFlight
+from .transport import HttpTransport
 from .utils import Utils
 
 
 class MoodleTool:
     """Communication with Moodle web services."""
 
+    _unreserved = re.compile(r"[A-Za-z0-9_.~\-\[\]]*")
+    responseCache = ResponseCache()
+    inflight = SingleFlight()
+
+    batchCallInfo: Dict[str, Any] = {
+        "name": "batch_call",
+        "description": "Executes several Moodle web service functions in one request, concurrently. "
+                       "Use it when the same function needs to be called for many ids (for example, course contents "
+                       "for several courses) or when several independent functions are needed. Each call succeeds "
+                       "or fails independently, results are returned in the same order as the calls.",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "calls": {
+                    "type": "array",
+                    "description": "List of web service function calls",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "wsfunction": {"type": "string", "description": "Name of the web service function (same as the tool name)"},
+                            "arguments": {"type": "object", "description": "Arguments of the function, including the "
+                                                                          "'mcp_fields', 'mcp_limit' and 'mcp_offset' options of its tool"},
+                        },
+                        "required": ["wsfunction"],
+                    },
+                },
+                "concurrency": {"type": "integer", "minimum": 1, "description": "Maximum number of calls executed at the same time"},
+            },
+            "required": ["calls"],
+        },
+        "outputSchema": {
+            "type": "object",
+            "properties": {
+                "results": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "wsfunction": {"type": "string"},
+                            "success": {"type": "boolean"},
+                            "result": {"description": "Result of the function if the call was successful"},
+                            "error": {"type": "string", "description": "Error message if the call failed"},
+                            "pagination": {**ResultProjection.paginationSchema, "description": "Present when the result "
+                                           "was paginated with 'mcp_limit' or 'mcp_offset', there is no cursor for the next page"},
+                        },
+                        "required": ["wsfunction", "success"],
+                    },
+                },
+            },
+            "required": ["results"],
+        },
+    }
+
+    # Only offered in stdio mode, in the multi-tenant HTTP mode statistics are exposed on the /metrics endpoint.
+    serverStatsInfo: Dict[str, Any] = {
+        "name": "server_stats",
+        "description": "Returns internal statistics of the MCP server: latency of calls to Moodle per function, "
+                       "payload sizes, errors and cache hit rates. Only useful for diagnosing performance problems.",
+        "inputSchema": {"type": "object", "properties": {}},
+    }
+
     @staticmethod
     def _urlencode_dict(d: Dict[str, Any]) -> str:
         """Encode a nested dictionary for Moodle web service requests."""
-        def _flatten(list_of_dicts: List[Dict[str, Any]]) -> Dict[str, Any]:
-            return {key: val for k in list_of_dicts for key, val in k.items()}
-
-        def _append_prefix(arg: Any, prefix: str) -> Dict[str, Any]:
-            if isinstance(arg, list):
-                return _flatten([_append_prefix(value, f"{prefix}[{index}]") for index, value in enumerate(arg)])
-            elif isinstance(arg, dict):
-                return _flatten([_append_prefix(value, f"{prefix}[{index}]") for index, value in arg.items()])
-            elif arg is None:
-                return {prefix: ""}
+        return "&".join(MoodleTool._iter_urlencoded(d))
+
+
+    @staticmethod
+    def _iter_urlencoded(d: Dict[str, Any]) -> Iterator[str]:
+        """
+        Yield encoded 'name=value' pairs of a nested dictionary, flattened the way PHP expects them (name[0][key]=value).
+
+        Nested values are walked iteratively with an explicit stack, no intermediate dictionaries are created. Since
+        brackets are not escaped, the encoded name of a nested value is built from the already encoded name of its parent.
+        """
+        quote = MoodleTool._quote
+        stack: List[Tuple[Optional[str], Iterator[Tuple[Any, Any]]]] = [(None, iter(d.items()))]
+        while stack:
+            prefix, items = stack[-1]
+            for key, value in items:
+                name = quote(key) if prefix is None else f"{prefix}[{quote(key)}]"
+                if isinstance(value, dict):
+                    stack.append((name, iter(value.items())))
+                    break
+                if isinstance(value, list):
+                    stack.append((name, enumerate(value)))
+                    break
+                yield name + "=" + ("" if value is None else quote(value))
             else:
-                return {prefix: arg}
+                stack.pop()
 
-        return urlencode(_flatten([_append_prefix(value, index) for index, value in d.items()]), safe='[]')
+
+    @staticmethod
+    def _quote(value: Any) -> str:
+        """Same as quote_plus(str(value), safe='[]') with a shortcut for the values that do not need escaping."""
+        if isinstance(value, int) and not isinstance(value, bool):
+            return str(value)
+        if isinstance(value, bytes):
+            return quote_plus(value, safe='[]')
+        value = str(value)
+        return value if MoodleTool._unreserved.fullmatch(value) else quote_plus(value, safe='[]')
 
 
     @staticmethod
-    async def execute_moodle_web_service(baseurl: str, wstoken: str, name: str, arguments: Dict[str, Any], tools: List[Tool]) -> ToolResult:
-        """Executes the tool by making a call to Moodle web service."""
-        data = {**arguments, "wstoken": wstoken, "wsfunction": name}
-        jsonresult = Utils.request_post_json_moodle(f"{baseurl}/webservice/rest/server.php?moodlewsrestformat=json",
-                               data=MoodleTool._urlencode_dict(data),
-                               allow_redirects=True,
-                               headers={'Content-Type': 'application/x-www-form-urlencoded'})
-        structured_content = {"result": jsonresult}
-        for tool in tools:
-            structured_content = MoodleTool._fix_empty_arrays(structured_content, tool.output_schema)
-        return ToolResult(structured_content=structured_content)
+    async def _stream_urlencoded(d: Dict[str, Any], chunksize: int = 64 * 1024) -> AsyncIterator[bytes]:
+        """Encode a nested dictionary into chunks of the request body, so that the whole body is never built in memory."""
+        buffer: List[str] = []
+        size = 0
+        separator = ""
+        for pair in MoodleTool._iter_urlencoded(d):
+            buffer.append(separator)
+            buffer.append(pair)
+            separator = "&"
+            size += len(pair) + 1
+            if size >= chunksize:
+                yield "".join(buffer).encode()
+                buffer = []
+                size = 0
+        if buffer:
+            yield "".join(buffer).encode()
 
 
     @staticmethod
-    def _fix_empty_arrays(result: Any, schema: Any) -> Any:
+    async def execute_moodle_web_service(baseurl: str, wstoken: str, name: str, arguments: Dict[str, Any],
+                                         normalizer: Optional[Normalizer] = None,
+                                         transform: Optional[Callable[[Any], Dict[str, Any]]] = None,
+                                         fields: Optional[Dict[str, Any]] = None) -> ToolResult:
         """
-        Fix PHP JSON encoding quirks where empty objects become empty arrays.
+        Executes the tool by making a call to Moodle web service. Normalizer compiled from the output schema fixes the result in place.
 
-        Since JSON was encoded with PHP, empty objects may appear as empty arrays.
-        This causes schema validation errors.
+        Transform builds the structured content from the result (for example selects only some fields), by default
+        the result is returned as is. Fields (projection tree) allow to drop unneeded fields while parsing the response.
         """
-        if schema is None or not isinstance(schema, dict) or schema.get("type", None) is None:
-            return result
+        result = await MoodleTool.call_moodle_web_service(baseurl, wstoken, name, arguments, normalizer, fields)
+        return ToolResult(structured_content=transform(result) if transform is not None else {"result": result})
 
-        # Fix empty arrays that should be objects
-        if schema["type"] == "object" and isinstance(result, list) and len(result) == 0:
-            return {}
 
-        # Recursively fix nested elements
-        if schema["type"] == "array" and isinstance(result, list) and schema.get("items", None) is not None:
-            return [MoodleTool._fix_empty_arrays(item, schema["items"]) for item in result]
-        if schema["type"] == "object" and isinstance(result, dict) and isinstance(schema.get("properties", None), dict):
-            return {k: MoodleTool._fix_empty_arrays(v, schema["properties"].get(k, None)) for k, v in result.items()}
-        return result
+    @staticmethod
+    async def call_moodle_web_service(baseurl: str, wstoken: str, name: str, arguments: Dict[str, Any],
+                                      normalizer: Optional[Normalizer] = None, fields: Optional[Dict[str, Any]] = None) -> Any:
+        """
+        Calls Moodle web service and returns the normalized result.
+
+        Results of read-only functions are served from the response cache when it is enabled. Concurrent identical calls
+        to read-only functions share one request to Moodle, so the returned result may be shared and must not be modified.
+        If the projection tree is given, the result may only contain these fields (unless it is going to be cached).
+        """
+        site = (baseurl, Utils.token_fingerprint(wstoken))
+        if MoodleTool.responseCache.caches(name):
+            # The full result is needed for the cache, the projection is applied by the caller.
+            fields = None
+        if not MoodleTool.responseCache.is_read_only(name):
+            return await MoodleTool._call_moodle_web_service(baseurl, wstoken, site, name, arguments, normalizer, fields)
+        key = (ResponseCache.call_key(site, name, arguments), id(normalizer),
+               json.dumps(fields, sort_keys=True) if fields is not None else None)
+        return await MoodleTool.inflight.run(
+            key, lambda: MoodleTool._call_moodle_web_service(baseurl, wstoken, site, name, arguments, normalizer, fields))
+
+
+    @staticmethod
+    async def _call_moodle_web_service(baseurl: str, wstoken: str, site: Tuple[str, str], name: str, arguments: Dict[str, Any],
+                                       normalizer: Optional[Normalizer], fields: Optional[Dict[str, Any]]) -> Any:
+        """Executes the call to Moodle web service, using the response cache."""
+        cachekey = MoodleTool.responseCache.key(site, name, arguments)
+        if cachekey is not None:
+            cached = MoodleTool.responseCache.get(cachekey)
+            if cached is not None:
+                return cached
+
+        data = {**arguments, "wstoken": wstoken, "wsfunction": name}
+        try:
+            with Metrics.track("moodle", name):
+                jsonresult = await Utils.request_post_json_moodle(f"{baseurl}/webservice/rest/server.php?moodlewsrestformat=json",
+                                       content=MoodleTool._stream_urlencoded(data) if Settings.get_bool("MOODLE_STREAM_REQUESTS", False)
+                                           else MoodleTool._urlencode_dict(data),
+                                       headers={'Content-Type': 'application/x-www-form-urlencoded'},
+                                       idempotent=MoodleTool.responseCache.is_read_only(name), fields=fields)
+        finally:
+            if not MoodleTool.responseCache.is_read_only(name):
+                # Even a failed call to a write function could have changed some data.
+                MoodleTool.responseCache.invalidate(site, name)
+        structured_content = {"result": jsonresult}
+        if normalizer is not None:
+            with Metrics.track("normalize", name):
+                structured_content = normalizer(structured_content)
+        if cachekey is not None:
+            MoodleTool.responseCache.put(cachekey, site, name, structured_content["result"])
+        return structured_content["result"]
+
+
+    # Maximum number of redirects followed when fetching a file from a URL for upload.
+    maxRedirects = 5
+
+    # Arguments of the download_file tool that are handled by this server, they are added to the tool definition.
+    downloadFileOptions: Dict[str, Any] = {
+        "metadata_only": {
+            "type": "boolean",
+            "description": "Only return the name, MIME type and size of the file without downloading it",
+        },
+        "offset": {
+            "type": "integer",
+            "minimum": 0,
+            "description": "Download the file starting from this byte",
+        },
+        "length": {
+            "type": "integer",
+            "minimum": 1,
+            "description": "Download at most this number of bytes",
+        },
+    }
+
+
+    @staticmethod
+    async def batch_call(baseurl: str, wstoken: str, arguments: Dict[str, Any], normalizers: Dict[str, Optional[Normalizer]]) -> ToolResult:
+        """
+        Executes a list of web service calls concurrently, with an error in one call not affecting the others.
+
+        Normalizers contain the functions available to the client, calls to other functions fail.
+        """
+        calls = arguments.get("calls", [])
+        if not isinstance(calls, list):
+            raise ToolError("Argument 'calls' must be a list")
+        maxcalls = Settings.get_int("MOODLE_BATCH_MAX_CALLS", 100)
+        if len(calls) > maxcalls:
+            raise ToolError(f"Too many calls in one batch, the maximum is {maxcalls}")
+
+        maxconcurrency = Settings.get_int("MOODLE_BATCH_CONCURRENCY", 5)
+        concurrency = max(1, min(int(arguments.get("concurrency") or maxconcurrency), maxconcurrency))
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def execute(call: Any) -> Dict[str, Any]:
+            name = call.get("wsfunction", "") if isinstance(call, dict) else ""
+            if not isinstance(name, str):
+                return {"wsfunction": "", "success": False, "error": "Argument 'wsfunction' must be a string"}
+            if name not in normalizers:
+                return {"wsfunction": name, "success": False, "error": f"Function '{name}' is not available"}
+            async with semaphore:
+                try:
+                    # Options that select fields and paginate the result are applied to each call, they are not sent to Moodle.
+                    callarguments, projection, cursor = ResultProjection.from_arguments(call.get("arguments") or {})
+                    if cursor is not None:
+                        raise ToolError("Argument 'mcp_cursor' is not supported in batch_call")
+                    result = await MoodleTool.call_moodle_web_service(
+                        baseurl, wstoken, name, callarguments, normalizers[name], projection.tree if projection is not None else None)
+                except Exception as e:
+                    return {"wsfunction": name, "success": False, "error": str(e)}
+            if projection is None:
+                return {"wsfunction": name, "success": True, "result": result}
+            result, pagination = projection.apply(result)
+            if pagination is None:
+                return {"wsfunction": name, "success": True, "result": result}
+            return {"wsfunction": name, "success": True, "result": result, "pagination": pagination}
+
+        results = await asyncio.gather(*[execute(call) for call in calls])
+        return ToolResult(structured_content={"results": results})
 
 
     @staticmethod
     async def upload_files(baseurl: str, wstoken: str, arguments: Dict[str, Any]) -> ToolResult:
         """Uploads one or more files to Moodle draft file area."""
         files = await MoodleTool._prepare_upload_files(arguments.get("files", []))
-        jsonresult = await MoodleTool._upload_to_moodle(baseurl, wstoken, arguments, files)
+        try:
+            jsonresult = await MoodleTool._upload_to_moodle(baseurl, wstoken, arguments, files)
+        finally:
+            for _, content in files:
+                content.close()
         structured_content = MoodleTool._parse_upload_response(jsonresult)
         return ToolResult(structured_content=structured_content)
 
 
     @staticmethod
-    async def _prepare_upload_files(file_specs: List[Dict[str, Any]]) -> Dict[str, bytes]:
-        """Prepare files for upload based on their upload type."""
-        files: Dict[str, bytes] = {}
-        for f in file_specs:
+    async def _prepare_upload_files(file_specs: List[Dict[str, Any]]) -> List[Tuple[str, IO[bytes]]]:
+        """
+        Prepare files for upload based on their upload type.
+
+        Contents are written to spooled temporary files (kept in memory while small), files from URLs are fetched concurrently.
+        """
+        async def prepare(f: Dict[str, Any]) -> Optional[Tuple[str, IO[bytes]]]:
             uploadtype = f.get("uploadtype", "base64")
             content = f.get("content", "")
             filename = f['filename']
 
             if uploadtype == "plaintext":
-                files[filename] = content.encode() if isinstance(content, str) else content
+                spool = MoodleTool._spool()
+                spool.write(content.encode() if isinstance(content, str) else content)
             elif uploadtype == "base64":
-                files[filename] = base64.b64decode(content)
+                spool = MoodleTool._spool()
+                MoodleTool._decode_base64(content, spool)
             elif uploadtype == "url":
-                files[filename] = await MoodleTool._fetch_file_from_url(content)
-
+                spool = await MoodleTool._fetch_file_from_url(content)
+            else:
+                return None
+            spool.seek(0)
+            return filename, spool
+
+        prepared = await asyncio.gather(*[prepare(f) for f in file_specs], return_exceptions=True)
+        files = [item for item in prepared if isinstance(item, tuple)]
+        errors = [item for item in prepared if isinstance(item, BaseException)]
+        if errors:
+            for _, content in files:
+                content.close()
+            raise errors[0]
         return files
 
 
     @staticmethod
-    async def _fetch_file_from_url(url: str) -> bytes:
-        """Fetch file content from a URL."""
-        result = requests.get(url)
-        if result.status_code != 200:
-            raise ToolError(f"Error fetching file from URL {url}: {result.status_code} {result.text}")
-        return result.content
+    def _spool() -> IO[bytes]:
+        return tempfile.SpooledTemporaryFile(max_size=DownloadedFile.spoolSize)
+
+
+    @staticmethod
+    def _decode_base64(content: str, output: IO[bytes], chunksize: int = 1024 * 1024) -> None:
+        """Decode base64 string in chunks, so that the whole decoded file is never held in memory together with the string."""
+        remainder = ""
+        for offset in range(0, len(content), chunksize):
+            chunk = remainder + "".join(content[offset:offset + chunksize].split())
+            cut = len(chunk) - len(chunk) % 4
+            output.write(base64.b64decode(chunk[:cut]))
+            remainder = chunk[cut:]
+        if remainder:
+            output.write(base64.b64decode(remainder))
+
+
+    @staticmethod
+    async def _fetch_file_from_url(url: str) -> IO[bytes]:
+        """
+        Fetch file content from a URL into a spooled temporary file.
+
+        In the HTTP mode the URL (and the target of every redirect) must match MOODLE_UPLOAD_ALLOWED_URLS and resolve
+        to public addresses only, otherwise any client could make the server fetch internal resources.
+        """
+        maxsize = Settings.get_int("MOODLE_UPLOAD_URL_MAX_BYTES", 50 * 1024 * 1024)
+        checked = Utils.is_http_mode()
+        spool = MoodleTool._spool()
+        try:
+            for _ in range(MoodleTool.maxRedirects + 1):
+                if checked:
+                    await MoodleTool._check_upload_url(url)
+                async with HttpTransport.stream_once("GET", url, follow_redirects=False) as result:
+                    if result.is_redirect and "Location" in result.headers:
+                        url = urljoin(url, result.headers["Location"])
+                        continue
+                    if result.status_code != 200:
+                        await result.aread()
+                        raise ToolError(f"Error fetching file from URL {url}: {result.status_code} {result.text}")
+                    contentlength = result.headers.get("Content-Length", "")
+                    size = int(contentlength) if contentlength.isdigit() else 0
+                    if size <= maxsize:
+                        size = 0
+                        async for chunk in result.aiter_bytes():
+                            size += len(chunk)
+                            if size > maxsize:
+                                break
+                            spool.write(chunk)
+                    if size > maxsize:
+                        raise ToolError(f"The file at {url} is too large to upload (more than {maxsize} bytes).")
+                    return spool
+            raise ToolError(f"Too many redirects fetching file from URL {url}")
+        except BaseException:
+            spool.close()
+            raise
+
+
+    @staticmethod
+    async def _check_upload_url(url: str) -> None:
+        if not Utils.url_matches(url, Settings.get_str("MOODLE_UPLOAD_ALLOWED_URLS")):
+            raise ToolError(f"Uploading files from {url} is not allowed on this server. Send the file contents instead.")
+        if not await Utils.is_public_host(urlparse(url).hostname or ""):
+            raise ToolError(f"Uploading files from {url} is not allowed, the host is not a public address.")
+
+
+    @staticmethod
+    def _split_uploads(files: List[Tuple[str, IO[bytes]]], maxsize: int) -> List[List[Tuple[str, IO[bytes]]]]:
+        """Split files into groups with total size under the threshold (a larger file is uploaded on its own)."""
+        groups: List[List[Tuple[str, IO[bytes]]]] = []
+        groupsize = 0
+        for filename, content in files:
+            size = content.seek(0, 2)
+            content.seek(0)
+            if not groups or (maxsize > 0 and groupsize + size > maxsize and groupsize > 0):
+                groups.append([])
+                groupsize = 0
+            groups[-1].append((filename, content))
+            groupsize += size
+        return groups
 
 
     @staticmethod
@@ -109,18 +413,33 @@ class MoodleTool:
         baseurl: str,
         wstoken: str,
         arguments: Dict[str, Any],
-        files: Dict[str, bytes]
-    ) -> Dict[str, Any]:
-        """Upload files to Moodle server."""
-        return Utils.request_post_json_moodle(
-            baseurl + "/webservice/upload.php",
-            data={
-                "token": wstoken,
-                "itemid": arguments.get("itemid"),
-                "filepath": arguments.get("filepath", "/"),
-            },
-            files=files
-        )
+        files: List[Tuple[str, IO[bytes]]]
+    ) -> Any:
+        """
+        Upload files to Moodle server. The multipart request body is streamed from the spooled files.
+
+        If the total size exceeds the threshold, the files are sent in several requests to the same draft area.
+        """
+        itemid = arguments.get("itemid")
+        jsonresult: Any = []
+        groups = MoodleTool._split_uploads(files, Settings.get_int("MOODLE_UPLOAD_SPLIT_BYTES", 20 * 1024 * 1024))
+        for group in groups:
+            result = await Utils.request_post_json_moodle(
+                baseurl + "/webservice/upload.php",
+                data={
+                    "token": wstoken,
+                    "itemid": itemid,
+                    "filepath": arguments.get("filepath", "/"),
+                },
+                # Moodle takes the name of the uploaded file from the multipart filename, not from the field name.
+                files=[(filename, (filename, content)) for filename, content in group]
+            )
+            if len(groups) == 1 or not isinstance(result, list):
+                return result
+            jsonresult.extend(result)
+            # When uploading to a new draft area (itemid 0), the next requests need to use the itemid that Moodle created.
+            itemid = next((element.get("itemid") for element in result if element.get("itemid")), itemid)
+        return jsonresult
 
 
     @staticmethod
@@ -187,5 +506,13 @@ class MoodleTool:
         else:
             raise ToolError("The provided URL is not a valid Moodle pluginfile URL. It is possible that you can download the file directly without authentication.")
 
-        file = await DownloadedFile.request_file(baseurl + pluginfileurl, wstoken)
+        if arguments.get("metadata_only"):
+            metadata = await DownloadedFile.request_metadata(baseurl + pluginfileurl, wstoken)
+            return ToolResult(structured_content=metadata)
+
+        offset = max(0, int(arguments.get("offset") or 0))
+        length = int(arguments["length"]) if arguments.get("length") is not None else None
+        if length is not None and length <= 0:
+            raise ToolError("The length must be a positive number")
+        file = await DownloadedFile.request_file(baseurl + pluginfileurl, wstoken, offset, length)
         return ToolResult(content=file)
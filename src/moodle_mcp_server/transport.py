@@ -0,0 +1,153 @@
+import asyncio
+import importlib.util
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Set
+from urllib.parse import urlparse
+import httpx
+from fastmcp.exceptions import FastMCPError
+from .metrics import Metrics
+from .resilience import Resilience
+from .settings import Settings
+
+
+class HttpTransport:
+    """Asynchronous HTTP transport with a shared keep-alive connection pool per site."""
+
+    _clients: Dict[str, httpx.AsyncClient] = {}
+    _closing: Set[asyncio.Task] = set()
+
+
+    @staticmethod
+    def pool_key(url: str) -> str:
+        """Connections can only be reused within the same scheme and host, so this is what we pool by."""
+        parsed = urlparse(url)
+        return f"{parsed.scheme}://{parsed.netloc}".lower()
+
+
+    @staticmethod
+    def _http2_enabled() -> bool:
+        """HTTP/2 is used when the optional 'h2' package is installed, unless disabled with MOODLE_HTTP2=0."""
+        return Settings.get_bool("MOODLE_HTTP2", True) and importlib.util.find_spec("h2") is not None
+
+
+    @staticmethod
+    def _create_client() -> httpx.AsyncClient:
+        """Create a client with pool size and timeouts configured from the environment."""
+        timeout = httpx.Timeout(
+            Settings.get_float("MOODLE_HTTP_TIMEOUT", 60),
+            connect=Settings.get_float("MOODLE_HTTP_CONNECT_TIMEOUT", 10),
+        )
+        limits = httpx.Limits(
+            max_connections=Settings.get_int("MOODLE_HTTP_MAX_CONNECTIONS", 20),
+            max_keepalive_connections=Settings.get_int("MOODLE_HTTP_MAX_KEEPALIVE", 10),
+            keepalive_expiry=Settings.get_float("MOODLE_HTTP_KEEPALIVE_EXPIRY", 30),
+        )
+        return httpx.AsyncClient(
+            timeout=timeout,
+            limits=limits,
+            http2=HttpTransport._http2_enabled(),
+            follow_redirects=True,
+        )
+
+
+    @staticmethod
+    def get_client(url: str) -> httpx.AsyncClient:
+        """Return the pooled client for the site of the given URL, creating it on first use."""
+        key = HttpTransport.pool_key(url)
+        client = HttpTransport._clients.get(key)
+        if client is None or client.is_closed:
+            client = HttpTransport._create_client()
+            HttpTransport._clients[key] = client
+        return client
+
+
+    @staticmethod
+    async def request(method: str, url: str, idempotent: bool = False, stream: bool = False, **kwargs: Any) -> httpx.Response:
+        """
+        Send a request through the pooled client. Network failures are reported as FastMCPError.
+
+        Requests pass the per-site limits and circuit breaker. GET/HEAD and requests marked as idempotent are retried
+        on timeouts and temporary errors, other requests only when the connection could not be established.
+        With stream=True the body is not read, the caller consumes it and must close the response.
+        """
+        content = kwargs.get("content")
+        if isinstance(content, (str, bytes)):
+            Metrics.observe_size("request", len(content))
+        client = HttpTransport.get_client(url)
+        try:
+            response = await Resilience.call(
+                HttpTransport.pool_key(url),
+                lambda: client.send(client.build_request(method, url, **kwargs), stream=stream),
+                idempotent=idempotent or method in ("GET", "HEAD"),
+                # Streamed bodies can only be sent once.
+                replayable=content is None or isinstance(content, (str, bytes)),
+            )
+        except httpx.HTTPError as e:
+            raise FastMCPError(f"Request to {url} failed: {type(e).__name__}: {str(e)}")
+        if not stream:
+            Metrics.observe_size("response", len(response.content))
+        return response
+
+
+    @staticmethod
+    @asynccontextmanager
+    async def stream(method: str, url: str, **kwargs: Any) -> AsyncIterator[httpx.Response]:
+        """Send a request and return the response without reading the body, so that it can be consumed in chunks."""
+        site = HttpTransport.pool_key(url)
+        guard = Resilience.guard(site)
+        try:
+            async with guard.slot(site):
+                try:
+                    async with HttpTransport.get_client(url).stream(method, url, **kwargs) as response:
+                        guard.breaker.record(response.status_code < 500)
+                        yield response
+                except httpx.TransportError:
+                    guard.breaker.record(False)
+                    raise
+        except httpx.HTTPError as e:
+            raise FastMCPError(f"Request to {url} failed: {type(e).__name__}: {str(e)}")
+
+
+    @staticmethod
+    @asynccontextmanager
+    async def stream_once(method: str, url: str, **kwargs: Any) -> AsyncIterator[httpx.Response]:
+        """
+        Like stream(), for a one-off request to an arbitrary URL (not a Moodle site). A short-lived client is used,
+        so that no connection pool and no per-site state is kept for hosts that may never be requested again.
+        """
+        try:
+            async with HttpTransport._create_client() as client:
+                async with client.stream(method, url, **kwargs) as response:
+                    yield response
+        except httpx.HTTPError as e:
+            raise FastMCPError(f"Request to {url} failed: {type(e).__name__}: {str(e)}")
+
+
+    @staticmethod
+    def release_pool(url: str) -> None:
+        """
+        Remove the pooled client of the site of the given URL, the next request will create a new one.
+
+        The old client is closed in the background after the read timeout, so that requests still in progress can finish.
+        """
+        Resilience.forget(HttpTransport.pool_key(url))
+        client = HttpTransport._clients.pop(HttpTransport.pool_key(url), None)
+        if client is not None:
+            task = asyncio.create_task(HttpTransport._close_later(client, Settings.get_float("MOODLE_HTTP_TIMEOUT", 60)))
+            HttpTransport._closing.add(task)
+            task.add_done_callback(HttpTransport._closing.discard)
+
+
+    @staticmethod
+    async def _close_later(client: httpx.AsyncClient, delay: float) -> None:
+        await asyncio.sleep(delay)
+        await client.aclose()
+
+
+    @staticmethod
+    async def aclose() -> None:
+        """Close all pooled connections."""
+        clients = list(HttpTransport._clients.values())
+        HttpTransport._clients.clear()
+        for client in clients:
+            await client.aclose()
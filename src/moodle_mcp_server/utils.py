@@ -1,11 +1,19 @@
-from typing import Any, Dict
+from typing import Any, Dict, Optional
+import asyncio
+import fnmatch
+import hashlib
+import ipaddress
+import httpx
 import os
-import requests
 from fastmcp import Context
 from fastmcp.exceptions import FastMCPError, ToolError
 from fastmcp.server.dependencies import get_http_headers
 from urllib.parse import urlparse
 from fastmcp.server.dependencies import get_http_request
+from .jsonstream import JsonStream
+from .metrics import Metrics
+from .settings import Settings
+from .transport import HttpTransport
 
 
 class Utils:
@@ -27,27 +35,120 @@ class Utils:
 
 
     @staticmethod
-    def request_post_json(url: str, **kwargs: Any) -> Dict[str, Any]:
-        """Sends a POST request and returns the JSON response."""
+    def get_credentials_from_headers() -> tuple[str, str]:
+        """
+        Retrieves Moodle site URL and web service token from the headers of the current HTTP request (multi-tenant HTTP mode).
+
+        The site URL is taken from the 'X-Moodle-Url' header, the token from 'X-Moodle-Token' or 'Authorization: Bearer'.
+        Returns empty strings if there is no HTTP request or the headers are not present.
+        """
+        headers = get_http_headers(include_all=True)
+        wstoken = headers.get("x-moodle-token", "").strip()
+        authorization = headers.get("authorization", "").strip()
+        if wstoken == "" and authorization.lower().startswith("bearer "):
+            wstoken = authorization[7:].strip()
+        return Utils.clean_baseurl(headers.get("x-moodle-url", "")), wstoken
+
+
+    @staticmethod
+    def url_matches(url: str, patterns: str) -> bool:
+        """
+        Check the URL against a comma-separated list of URL patterns. Scheme, host and path are compared separately,
+        wildcards are allowed in the host name (for example 'https://*.example.com'), a pattern without a path allows
+        any path on the host. URLs with user info never match, so that the host can not be disguised.
+        """
+        try:
+            parsed = urlparse(url)
+            host = f"{parsed.hostname}:{parsed.port}" if parsed.port else parsed.hostname or ""
+        except ValueError:
+            return False
+        if parsed.username is not None or parsed.password is not None or not parsed.hostname:
+            return False
+        for pattern in patterns.split(","):
+            pattern = Utils.clean_baseurl(pattern)
+            allowed = urlparse(pattern if "://" in pattern else "https://" + pattern)
+            if (pattern and allowed.scheme == parsed.scheme and fnmatch.fnmatchcase(host, allowed.netloc)
+                    and (not allowed.path or fnmatch.fnmatchcase(parsed.path, allowed.path))):
+                return True
+        return False
+
+
+    @staticmethod
+    async def is_public_host(hostname: str) -> bool:
+        """True if all addresses of the host are public (not loopback, private, link-local or reserved)."""
+        try:
+            addresses = await asyncio.get_running_loop().getaddrinfo(hostname, None)
+        except OSError:
+            return False
+        return bool(addresses) and all(ipaddress.ip_address(address[4][0].split("%")[0]).is_global for address in addresses)
+
+
+    @staticmethod
+    def is_http_mode() -> bool:
+        """True if the server runs in the multi-tenant HTTP mode, or the current request came over HTTP."""
+        return (Settings.get_str("MOODLE_MCP_TRANSPORT", "stdio").lower() in ("http", "streamable-http", "sse")
+                or Utils.is_http_request())
+
+
+    @staticmethod
+    def is_http_request() -> bool:
+        """True if the current MCP request came over HTTP (not stdio)."""
+        try:
+            get_http_request()
+        except RuntimeError:
+            return False
+        return True
+
+
+    @staticmethod
+    def token_fingerprint(wstoken: str) -> str:
+        """Short non-reversible identifier of the token, suitable for use in cache keys."""
+        return hashlib.sha256(wstoken.encode('utf-8')).hexdigest()[:16]
+
+
+    @staticmethod
+    async def request_post_json(url: str, idempotent: bool = False, fields: Optional[Dict[str, Any]] = None, **kwargs: Any) -> Any:
+        """
+        Sends a POST request and returns the JSON response. Idempotent requests are retried on temporary failures.
+
+        If only some fields are needed (projection tree), large responses are parsed incrementally when possible.
+        """
         args = {**kwargs}
         args["headers"] = args.get("headers", {})
         args["headers"]["Accept"] = "application/json"
         if "json" in args:
             args["headers"]["Content-Type"] = "application/json"
-        result = requests.post(url, **args)
-        if result.status_code != 200:
-            raise FastMCPError(f"Request to {url} returned {result.status_code}: {result.text}")
+        if fields is None or not JsonStream.available():
+            result = await HttpTransport.request("POST", url, idempotent=idempotent, **args)
+            if result.status_code != 200:
+                raise FastMCPError(f"Request to {url} returned {result.status_code}: {result.text}")
+            try:
+                jsonresult = result.json()
+            except Exception as e:
+                raise FastMCPError(f"Request to {url} returned invalid JSON: {str(e)}")
+            return jsonresult
+
+        result = await HttpTransport.request("POST", url, idempotent=idempotent, stream=True, **args)
         try:
-            jsonresult = result.json()
+            if result.status_code != 200:
+                await result.aread()
+                raise FastMCPError(f"Request to {url} returned {result.status_code}: {result.text}")
+            return await JsonStream.parse(result, fields)
+        except httpx.HTTPError as e:
+            raise FastMCPError(f"Request to {url} failed: {type(e).__name__}: {str(e)}")
+        except FastMCPError:
+            raise
         except Exception as e:
             raise FastMCPError(f"Request to {url} returned invalid JSON: {str(e)}")
-        return jsonresult
+        finally:
+            await result.aclose()
 
 
     @staticmethod
-    def request_post_json_moodle(url: str, **kwargs: Any) -> Dict[str, Any]:
+    async def request_post_json_moodle(url: str, idempotent: bool = False, fields: Optional[Dict[str, Any]] = None, **kwargs: Any) -> Any:
         """Sends a POST request to Moodle and returns the JSON response. Moodle can return 200 status code even for errors."""
-        jsonresult = Utils.request_post_json(url, **kwargs)
+        jsonresult = await Utils.request_post_json(url, idempotent=idempotent, fields=fields, **kwargs)
         if (isinstance(jsonresult, dict) and jsonresult.get("exception", None) is not None):
+            Metrics.count_moodle_exception(str(jsonresult.get("exception")))
             raise ToolError(jsonresult.get("message", jsonresult.get("exception")))
         return jsonresult
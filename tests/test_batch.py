@@ -0,0 +1,48 @@
+import asyncio
+from moodle_mcp_server.catalog import CatalogEntry
+from moodle_mcp_server.middleware import MoodleMiddleware
+from moodle_mcp_server.tools import MoodleTool
+
+SITE = ("https://moodle.example.com", "fingerprint")
+
+GET_COURSES = {"name": "core_course_get_courses", "description": "Courses.",
+               "inputSchema": {"type": "object", "properties": {"ids": {"type": "array", "items": {"type": "integer"}}}}}
+
+
+def test_function_name_must_be_a_string(monkeypatch):
+    monkeypatch.setenv("MOODLE_SCHEMA_CACHE", "0")
+    arguments = {"calls": [{"wsfunction": {"a": 1}}, {"wsfunction": ["x"]}]}
+    normalizers = asyncio.run(MoodleMiddleware()._batch_normalizers(SITE, None, arguments))
+    assert normalizers == {}
+    result = asyncio.run(MoodleTool.batch_call(*SITE, arguments, normalizers))
+    assert [item["success"] for item in result.structured_content["results"]] == [False, False]
+
+
+def test_unregistered_function_is_restored_from_catalog(monkeypatch):
+    monkeypatch.setenv("MOODLE_SCHEMA_CACHE", "0")
+    middleware = MoodleMiddleware()
+    # The catalog is cached but the tools are not registered, as after the tenant was evicted from the registry.
+    middleware._catalog.put(SITE, CatalogEntry([GET_COURSES]))
+    arguments = {"calls": [{"wsfunction": "core_course_get_courses"}, {"wsfunction": "core_missing"}]}
+    normalizers = asyncio.run(middleware._batch_normalizers(SITE, None, arguments))
+    assert list(normalizers) == ["core_course_get_courses"]
+
+
+def test_projection_options_are_applied_per_call(monkeypatch):
+    sent = []
+
+    async def call_moodle_web_service(baseurl, wstoken, name, arguments, normalizer=None, fields=None):
+        sent.append(arguments)
+        return [{"id": i, "fullname": f"Course {i}", "summary": "..."} for i in range(5)]
+
+    monkeypatch.setattr(MoodleTool, "call_moodle_web_service", staticmethod(call_moodle_web_service))
+    arguments = {"calls": [
+        {"wsfunction": "core_course_get_courses", "arguments": {"ids": [1], "mcp_fields": ["id"], "mcp_limit": 2}},
+        {"wsfunction": "core_course_get_courses", "arguments": {"mcp_cursor": "abc:2"}},
+    ]}
+    result = asyncio.run(MoodleTool.batch_call(*SITE, arguments, {"core_course_get_courses": None}))
+    first, second = result.structured_content["results"]
+    assert sent == [{"ids": [1]}]
+    assert first["result"] == [{"id": 0}, {"id": 1}]
+    assert first["pagination"] == {"offset": 0, "limit": 2, "total": 5, "next_cursor": None}
+    assert not second["success"]
@@ -0,0 +1,119 @@
+import asyncio
+import sqlite3
+import pytest
+from types import SimpleNamespace
+from fastmcp.exceptions import FastMCPError, ToolError
+from moodle_mcp_server.catalog import CatalogEntry
+from moodle_mcp_server.middleware import MoodleMiddleware
+from moodle_mcp_server.utils import Utils
+
+SITE = ("https://moodle.example.com", "fingerprint")
+
+
+def test_failed_refresh_can_be_retried(monkeypatch):
+    monkeypatch.setenv("MOODLE_SCHEMA_CACHE", "0")
+    middleware = MoodleMiddleware()
+    previous, _ = middleware._catalog.put(SITE, CatalogEntry([{"name": "core_course_get_courses"}]))
+
+    async def load_catalog(ctx, previous=None):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(middleware, "_load_catalog", load_catalog)
+    previous.refresh_task = object()
+    asyncio.run(middleware._refresh_catalog(SITE, SimpleNamespace(session=None), previous))
+    assert previous.refresh_task is None
+    assert middleware._catalog.peek(SITE) is previous
+
+
+def tool_info(name):
+    return {"name": name, "description": name, "inputSchema": {"type": "object", "properties": {}},
+            "outputSchema": {"type": "object", "properties": {"result": {"type": "object"}}}}
+
+
+def sync_middleware(monkeypatch):
+    monkeypatch.setenv("MOODLE_SCHEMA_CACHE", "0")
+    middleware = MoodleMiddleware()
+    loads = []
+
+    async def load_catalog(ctx, previous=None):
+        loads.append(previous)
+        return CatalogEntry([tool_info("core_course_get_courses")])
+
+    monkeypatch.setattr(middleware, "_load_catalog", load_catalog)
+    return middleware, loads
+
+
+def test_evicted_tool_is_restored_without_loading(monkeypatch):
+    middleware, loads = sync_middleware(monkeypatch)
+    entry, _ = middleware._catalog.put(SITE, CatalogEntry([tool_info("core_course_get_courses")]))
+    middleware._register_tools(SITE, entry)
+    middleware._registry.forget_site(SITE)
+    variant = asyncio.run(middleware._sync_catalog(SITE, SimpleNamespace(session=None), "core_course_get_courses"))
+    assert variant.tool.name == "core_course_get_courses"
+    assert loads == []
+
+
+def test_unknown_tool_with_fresh_catalog_is_not_loaded(monkeypatch):
+    middleware, loads = sync_middleware(monkeypatch)
+    middleware._catalog.put(SITE, CatalogEntry([tool_info("core_course_get_courses")]))
+    with pytest.raises(ToolError):
+        asyncio.run(middleware._sync_catalog(SITE, SimpleNamespace(session=None), "unknown_function"))
+    assert loads == []
+
+
+def test_syncs_are_rate_limited(monkeypatch):
+    middleware, loads = sync_middleware(monkeypatch)
+    middleware._catalog.ttl = 0
+    ctx = SimpleNamespace(session=None)
+    # After a restart nothing is cached, the catalog is loaded for the first call.
+    assert asyncio.run(middleware._sync_catalog(SITE, ctx, "core_course_get_courses")) is not None
+    for _ in range(3):
+        with pytest.raises(ToolError):
+            asyncio.run(middleware._sync_catalog(SITE, ctx, "unknown_function"))
+    assert len(loads) == 1
+
+
+def test_functions_from_lookup_outage_are_not_kept_as_helper_tools(monkeypatch):
+    monkeypatch.setenv("MOODLE_SCHEMA_CACHE", "0")
+    middleware = MoodleMiddleware()
+    listing = {"functions": [{"name": "core_x_get_a", "version": 1}]}
+    lookup = {"available": True, "version": "new"}
+
+    async def load_function_list(ctx):
+        return listing, None
+
+    async def request_post_json(url, **kwargs):
+        if not lookup["available"]:
+            raise FastMCPError("Lookup service is not available")
+        names = [item["name"] for item in kwargs["json"]["functions"]]
+        return {"functions": [{**tool_info(name), "description": lookup["version"]} for name in names] + [tool_info("upload_files")]}
+
+    monkeypatch.setattr(middleware, "_load_function_list", load_function_list)
+    monkeypatch.setattr(Utils, "request_post_json", staticmethod(request_post_json))
+    monkeypatch.setattr(middleware._schema_store, "get_latest", lambda names: {
+        name: {**tool_info(name), "description": "latest"} for name in names})
+
+    entry = asyncio.run(middleware._load_catalog(None))
+    assert entry.extras == {"upload_files"}
+
+    # The function changes during an outage of the lookup service, the latest known definition is used.
+    listing["functions"] = [{"name": "core_x_get_a", "version": 2}]
+    lookup["available"] = False
+    entry = asyncio.run(middleware._load_catalog(None, entry))
+    assert sorted(f["name"] for f in entry.functions) == ["core_x_get_a", "upload_files"]
+
+    lookup["available"] = True
+    entry = asyncio.run(middleware._load_catalog(None, entry))
+    assert [(f["name"], f["description"]) for f in entry.functions if f["name"] == "core_x_get_a"] == [("core_x_get_a", "new")]
+
+    # A removed function disappears even if the lookup service is not available.
+    listing["functions"] = [{"name": "core_x_get_b", "version": 1}]
+    lookup["available"] = False
+    monkeypatch.setattr(middleware._schema_store, "get_latest", lambda names: {})
+    with pytest.raises(FastMCPError):
+        asyncio.run(middleware._load_catalog(None, entry))
+    listing["functions"].append({"name": "core_x_get_a", "version": 2})
+    listing["functions"].remove({"name": "core_x_get_b", "version": 1})
+    listing["functions"].append({"name": "core_x_get_c", "version": 1})
+    entry = asyncio.run(middleware._load_catalog(None, entry))
+    assert sorted(f["name"] for f in entry.functions) == ["core_x_get_a", "upload_files"]
@@ -0,0 +1,36 @@
+from moodle_mcp_server.chunking import BulkChunker
+from moodle_mcp_server.middleware import MoodleMiddleware
+
+
+CREATE_USERS = {
+    "name": "core_user_create_users",
+    "description": "Create users.",
+    "inputSchema": {
+        "type": "object",
+        "properties": {
+            "users": {"type": "array", "items": {"type": "object", "properties": {
+                "username": {"type": "string"}, "email": {"type": "string"}}}},
+        },
+        "required": ["users"],
+    },
+    "outputSchema": {"type": "object", "properties": {"result": {"type": "array", "items": {"type": "object"}}}},
+}
+
+
+def test_array_argument_of_listed_tool(monkeypatch):
+    # The listed tool has the projection options (including the 'mcp_fields' array) added to its input schema.
+    monkeypatch.setenv("MOODLE_SCHEMA_CACHE", "0")
+    tool = MoodleMiddleware()._create_tool_from_info(CREATE_USERS)
+    assert "mcp_fields" in tool.parameters["properties"]
+    assert BulkChunker.find_array_argument("core_user_create_users", tool.parameters) == "users"
+
+
+def test_listed_tool_is_split(monkeypatch):
+    monkeypatch.setenv("MOODLE_SCHEMA_CACHE", "0")
+    monkeypatch.setenv("MOODLE_CHUNK_SIZE", "100")
+    tool = MoodleMiddleware()._create_tool_from_info(CREATE_USERS)
+    key = BulkChunker.find_array_argument("core_user_create_users", tool.parameters)
+    users = [{"username": f"user{i}", "email": f"user{i}@example.com"} for i in range(5000)]
+    chunks = BulkChunker.split({"users": users}, key)
+    assert len(chunks) == 50
+    assert chunks[1][0] == 100
@@ -0,0 +1,69 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+from fastmcp.exceptions import FastMCPError
+from moodle_mcp_server.middleware import MoodleMiddleware
+from moodle_mcp_server.tools import MoodleTool
+from moodle_mcp_server.utils import Utils
+
+
+@pytest.mark.parametrize("baseurl, allowed", [
+    ("https://school.example.com", True),
+    ("https://school.example.com/moodle", True),
+    ("http://school.example.com", False),
+    ("https://example.com", False),
+    ("https://169.254.169.254/x.example.com", False),
+    ("https://school.example.com@169.254.169.254", False),
+    ("https://moodle.org/demo", True),
+    ("https://moodle.org/other", False),
+])
+def test_allowed_sites(monkeypatch, baseurl, allowed):
+    monkeypatch.setenv("MOODLE_ALLOWED_SITES", "https://*.example.com, https://moodle.org/demo")
+    assert MoodleMiddleware._is_allowed_site(baseurl) is allowed
+
+
+def test_no_site_is_allowed_without_list(monkeypatch):
+    monkeypatch.delenv("MOODLE_ALLOWED_SITES", raising=False)
+    assert not MoodleMiddleware._is_allowed_site("http://localhost:8080")
+
+
+def test_http_mode_requires_headers(monkeypatch):
+    monkeypatch.setenv("MOODLE_SCHEMA_CACHE", "0")
+    monkeypatch.setenv("MOODLE", "https://moodle.example.com")
+    monkeypatch.setenv("TOKEN", "secret")
+    monkeypatch.setattr(Utils, "get_credentials_from_headers", staticmethod(lambda: ("", "")))
+    middleware = MoodleMiddleware()
+
+    monkeypatch.setenv("MOODLE_MCP_TRANSPORT", "http")
+    with pytest.raises(FastMCPError):
+        asyncio.run(middleware._get_credentials(None))
+
+    monkeypatch.setenv("MOODLE_HTTP_ENV_CREDENTIALS", "1")
+    assert asyncio.run(middleware._get_credentials(None)) == ("https://moodle.example.com", "secret")
+
+    monkeypatch.setenv("MOODLE_MCP_TRANSPORT", "stdio")
+    monkeypatch.delenv("MOODLE_HTTP_ENV_CREDENTIALS")
+    assert asyncio.run(middleware._get_credentials(None)) == ("https://moodle.example.com", "secret")
+
+
+def test_public_host():
+    assert not asyncio.run(Utils.is_public_host("127.0.0.1"))
+    assert not asyncio.run(Utils.is_public_host("169.254.169.254"))
+    assert not asyncio.run(Utils.is_public_host("10.0.0.1"))
+    assert asyncio.run(Utils.is_public_host("8.8.8.8"))
+
+
+def test_file_tools_track_the_tenant(monkeypatch):
+    monkeypatch.setenv("MOODLE_SCHEMA_CACHE", "0")
+    monkeypatch.setenv("MOODLE", "https://moodle.example.com")
+    monkeypatch.setenv("TOKEN", "secret")
+    monkeypatch.setattr(Utils, "get_credentials_from_headers", staticmethod(lambda: ("", "")))
+
+    async def download_file(baseurl, wstoken, arguments):
+        return None
+
+    monkeypatch.setattr(MoodleTool, "download_file", staticmethod(download_file))
+    middleware = MoodleMiddleware()
+    context = SimpleNamespace(fastmcp_context=None, message=SimpleNamespace(name="download_file", arguments={}))
+    asyncio.run(middleware._call_tool(context))
+    assert middleware._tenants.is_active(MoodleMiddleware._site_key("https://moodle.example.com", "secret"))
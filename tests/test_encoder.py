@@ -0,0 +1,47 @@
+import asyncio
+from typing import Any, Dict, List
+from urllib.parse import urlencode
+from moodle_mcp_server.tools import MoodleTool
+
+
+def reference(d: Dict[str, Any]) -> str:
+    """The encoder before it was made iterative, which built the flattened dictionary for urlencode()."""
+    def _flatten(list_of_dicts: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {key: val for k in list_of_dicts for key, val in k.items()}
+
+    def _append_prefix(arg: Any, prefix: str) -> Dict[str, Any]:
+        if isinstance(arg, list):
+            return _flatten([_append_prefix(value, f"{prefix}[{index}]") for index, value in enumerate(arg)])
+        elif isinstance(arg, dict):
+            return _flatten([_append_prefix(value, f"{prefix}[{index}]") for index, value in arg.items()])
+        elif arg is None:
+            return {prefix: ""}
+        else:
+            return {prefix: arg}
+
+    return urlencode(_flatten([_append_prefix(value, index) for index, value in d.items()]), safe='[]')
+
+
+ARGUMENTS = {
+    "wstoken": "abc",
+    "wsfunction": "core_user_create_users",
+    "users": [
+        {"username": "jürgen", "firstname": "Jür gen", "lastname": "O'Brien & Söhne", "email": "j+1@example.com",
+         "customfields": [{"type": "city", "value": "Zürich/Genève"}, {"type": "note", "value": None}],
+         "preferences": {"lang": "日本語", "empty": {}}},
+        {"username": "x=y", "suspended": 0, "auth": True, "score": 1.5, "notes": []},
+    ],
+    "options": {"ids": [3, 1, 2], "nested": {"deep": [[1, 2], {"a": None}]}},
+    "ünïcode kéy": "välue",
+}
+
+
+def test_encoding_matches_urlencode():
+    assert MoodleTool._urlencode_dict(ARGUMENTS) == reference(ARGUMENTS)
+
+
+def test_streamed_encoding_matches_urlencode():
+    async def collect():
+        return b"".join([chunk async for chunk in MoodleTool._stream_urlencoded(ARGUMENTS, chunksize=16)])
+
+    assert asyncio.run(collect()).decode() == reference(ARGUMENTS)
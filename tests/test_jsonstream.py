@@ -0,0 +1,56 @@
+import asyncio
+import json
+import pytest
+import httpx
+from moodle_mcp_server.jsonstream import JsonStream
+from moodle_mcp_server.projection import ResultProjection
+
+pytest.importorskip("ijson")
+
+COURSES = {
+    "courses": [{"id": i, "fullname": f"Course {i}", "summary": "x" * 50, "format": None, "visible": True,
+                 "options": [{"name": "a", "value": 1.5}, {"name": "b", "value": [1, {"c": 2}]}],
+                 "contacts": [], "extra": {"nested": {"deep": [i]}}} for i in range(20)],
+    "warnings": [{"item": "course", "warningcode": "1", "message": "Warning"}],
+    "total": 20,
+}
+
+
+def parse(document, fields):
+    body = json.dumps(document).encode()
+
+    async def chunks():
+        for start in range(0, len(body), 7):
+            yield body[start:start + 7]
+
+    response = httpx.Response(200, stream=_Stream(chunks()))
+    return asyncio.run(JsonStream.parse(response, ResultProjection.compile_fields(fields)))
+
+
+class _Stream(httpx.AsyncByteStream):
+    def __init__(self, chunks) -> None:
+        self._chunks = chunks
+
+    async def __aiter__(self):
+        async for chunk in self._chunks:
+            yield chunk
+
+
+@pytest.mark.parametrize("fields", [
+    ["courses.id"],
+    ["courses.id", "courses.options.name", "warnings"],
+    ["courses.extra.nested", "total"],
+    ["courses.*"],
+    ["*"],
+    ["courses.options.value.c"],
+    ["missing"],
+])
+def test_wrapped_array_matches_projection(monkeypatch, fields):
+    monkeypatch.setenv("MOODLE_STREAM_PARSE_MIN_BYTES", "0")
+    assert parse(COURSES, fields) == ResultProjection.project(COURSES, ResultProjection.compile_fields(fields))
+
+
+def test_error_is_kept(monkeypatch):
+    monkeypatch.setenv("MOODLE_STREAM_PARSE_MIN_BYTES", "0")
+    error = {"exception": "moodle_exception", "errorcode": "invalidtoken", "message": "Invalid token"}
+    assert parse(error, ["courses.id"]) == error
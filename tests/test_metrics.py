@@ -0,0 +1,32 @@
+import asyncio
+from starlette.requests import Request
+from moodle_mcp_server.catalog import CatalogEntry
+from moodle_mcp_server.main import metrics
+from moodle_mcp_server.metrics import Metrics
+from moodle_mcp_server.middleware import MoodleMiddleware
+
+
+def metrics_request(authorization=None):
+    headers = [(b"authorization", authorization.encode())] if authorization is not None else []
+    return Request({"type": "http", "method": "GET", "path": "/metrics", "headers": headers, "query_string": b""})
+
+
+def test_unlisted_tools_are_not_used_as_labels(monkeypatch):
+    monkeypatch.setenv("MOODLE_SCHEMA_CACHE", "0")
+    middleware = MoodleMiddleware()
+    toolinfo = {"name": "core_x_get_items", "description": "Items.", "inputSchema": {"type": "object", "properties": {}}}
+    assert middleware._metrics_label("core_x_get_items") == "unknown"
+    middleware._register_tools(("https://moodle.example.com", "fingerprint"), CatalogEntry([toolinfo]))
+    assert middleware._metrics_label("core_x_get_items") == "core_x_get_items"
+    assert middleware._metrics_label("upload_files") == "upload_files"
+    assert middleware._metrics_label("x" * 1000) == "unknown"
+
+
+def test_metrics_endpoint_requires_token(monkeypatch):
+    monkeypatch.setattr(Metrics, "enabled", True)
+    monkeypatch.delenv("MOODLE_METRICS_TOKEN", raising=False)
+    assert asyncio.run(metrics(metrics_request("Bearer secret"))).status_code == 404
+    monkeypatch.setenv("MOODLE_METRICS_TOKEN", "secret")
+    assert asyncio.run(metrics(metrics_request())).status_code == 401
+    assert asyncio.run(metrics(metrics_request("Bearer wrong"))).status_code == 401
+    assert asyncio.run(metrics(metrics_request("Bearer secret"))).status_code == 200
@@ -0,0 +1,13 @@
+import jsonschema
+from moodle_mcp_server.projection import ResultProjection, ResultPages
+
+
+OUTPUT_SCHEMA = {"type": "object", "properties": {"result": {"type": "array", "items": {"type": "object"}}}}
+
+
+def test_offset_without_limit_matches_output_schema():
+    _, projection, _ = ResultProjection.from_arguments({"mcp_offset": 2})
+    content = ResultPages(ttl=300, max_entries=10).paginate(("https://moodle.example.com", "x"), "f", [{"id": i} for i in range(5)], projection)
+    assert content["result"] == [{"id": 2}, {"id": 3}, {"id": 4}]
+    assert content["pagination"]["limit"] is None
+    jsonschema.validate(content, ResultProjection.extend_output_schema(OUTPUT_SCHEMA))
@@ -0,0 +1,64 @@
+from moodle_mcp_server.catalog import CatalogEntry
+from moodle_mcp_server.middleware import MoodleMiddleware
+from moodle_mcp_server.registry import ToolRegistry
+
+
+def tool_info(name, description="Returns the items."):
+    return {"name": name, "description": description,
+            "inputSchema": {"type": "object", "properties": {"courseid": {"type": "integer"}}},
+            "outputSchema": {"type": "object", "properties": {"result": {"type": "array", "items": {"type": "object"}}}}}
+
+
+def counting_builder(middleware, built):
+    def build(toolinfo):
+        built.append(toolinfo["name"])
+        return middleware._build_tool(toolinfo)
+    return build
+
+
+def test_number_of_toolsets_follows_the_number_of_tenants(monkeypatch):
+    monkeypatch.setenv("MOODLE_SCHEMA_CACHE", "0")
+    monkeypatch.setenv("MOODLE_MAX_TENANTS", "40")
+    assert MoodleMiddleware()._registry.max_toolsets == 40
+    monkeypatch.setenv("MOODLE_TOOLSETS", "5")
+    assert MoodleMiddleware()._registry.max_toolsets == 5
+
+
+def test_new_catalog_version_builds_only_changed_definitions(monkeypatch):
+    monkeypatch.setenv("MOODLE_SCHEMA_CACHE", "0")
+    middleware = MoodleMiddleware()
+    registry = ToolRegistry(max_toolsets=2)
+    built = []
+    first = [tool_info(f"core_x_get_{i}") for i in range(10)]
+    second = first[:9] + [tool_info("core_x_get_9", "Changed.")]
+    registry.register_catalog(("a", "t"), CatalogEntry.compute_digest(first), first, counting_builder(middleware, built))
+    assert len(built) == 10
+    built.clear()
+    tools = registry.register_catalog(("b", "t"), CatalogEntry.compute_digest(second), second, counting_builder(middleware, built))
+    assert built == ["core_x_get_9"]
+    assert [tool.description for tool in tools if tool.name == "core_x_get_9"] == ["Changed."]
+    assert registry.lookup(("b", "t"), "core_x_get_0") is not None
+
+    # Tools of evicted versions are released.
+    third = [tool_info("core_y_get")]
+    registry.register_catalog(("c", "t"), CatalogEntry.compute_digest(third), third, counting_builder(middleware, built))
+    assert registry.stats()["toolsets"] == 2
+    assert registry.stats()["definitions"] == 11
+
+
+def test_tool_of_evicted_toolset_is_restored_alone(monkeypatch):
+    monkeypatch.setenv("MOODLE_SCHEMA_CACHE", "0")
+    monkeypatch.setenv("MOODLE_TOOLSETS", "1")
+    middleware = MoodleMiddleware()
+    site = ("https://moodle.example.com", "fingerprint")
+    entry = CatalogEntry([tool_info(f"core_x_get_{i}") for i in range(10)])
+    middleware._register_tools(site, entry)
+    middleware._register_tools(("https://other.example.com", "fingerprint"), CatalogEntry([tool_info("core_y_get")]))
+    middleware._registry.forget_site(site)
+    built = []
+    build_tool = middleware._build_tool
+    monkeypatch.setattr(middleware, "_build_tool", lambda toolinfo: built.append(toolinfo["name"]) or build_tool(toolinfo))
+    variant = middleware._restore_tool(site, entry, "core_x_get_3")
+    assert variant is not None and variant.tool.name == "core_x_get_3"
+    assert built == ["core_x_get_3"]
+    assert middleware._registry.lookup(site, "core_x_get_3") is variant
@@ -0,0 +1,102 @@
+import asyncio
+import httpx
+import pytest
+from fastmcp.exceptions import FastMCPError
+from moodle_mcp_server.resilience import Resilience
+from moodle_mcp_server.transport import HttpTransport
+
+URL = "https://moodle.example.com/webservice/rest/server.php"
+
+
+@pytest.fixture
+def mock_site(monkeypatch):
+    """Route the requests to the site through the handler, with fresh pools and site guards and no backoff."""
+    monkeypatch.setattr(HttpTransport, "_clients", {})
+    monkeypatch.setattr(Resilience, "_guards", {})
+    monkeypatch.setenv("MOODLE_RETRY_BACKOFF", "0")
+
+    def install(handler):
+        HttpTransport._clients[HttpTransport.pool_key(URL)] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return install
+
+
+def test_writes_are_not_retried_on_503(mock_site):
+    attempts = []
+    mock_site(lambda request: attempts.append(request) or httpx.Response(503))
+    response = asyncio.run(HttpTransport.request("POST", URL, content="wsfunction=core_user_create_users"))
+    assert response.status_code == 503
+    assert len(attempts) == 1
+
+
+def test_idempotent_requests_are_retried_on_503(mock_site):
+    attempts = []
+    mock_site(lambda request: attempts.append(request) or httpx.Response(503 if len(attempts) < 3 else 200, json=[]))
+    response = asyncio.run(HttpTransport.request("POST", URL, idempotent=True, content="wsfunction=core_course_get_courses"))
+    assert response.status_code == 200
+    assert len(attempts) == 3
+
+
+def test_connect_errors_are_retried_for_writes(mock_site):
+    attempts = []
+
+    def handler(request):
+        attempts.append(request)
+        if len(attempts) == 1:
+            raise httpx.ConnectError("Connection refused", request=request)
+        return httpx.Response(200, json={})
+
+    mock_site(handler)
+    response = asyncio.run(HttpTransport.request("POST", URL, content="wsfunction=core_user_create_users"))
+    assert response.status_code == 200
+    assert [a.content for a in attempts] == [b"wsfunction=core_user_create_users"] * 2
+
+
+def test_read_errors_of_writes_are_not_retried(mock_site):
+    attempts = []
+
+    def handler(request):
+        attempts.append(request)
+        raise httpx.ReadTimeout("Timed out", request=request)
+
+    mock_site(handler)
+    with pytest.raises(FastMCPError):
+        asyncio.run(HttpTransport.request("POST", URL, content="wsfunction=core_user_create_users"))
+    assert len(attempts) == 1
+
+
+def test_open_breaker_lets_one_probe_through(mock_site, monkeypatch):
+    monkeypatch.setenv("MOODLE_RETRIES", "0")
+    monkeypatch.setenv("MOODLE_CIRCUIT_FAILURES", "2")
+    monkeypatch.setenv("MOODLE_CIRCUIT_RESET", "0.05")
+    attempts = []
+    status = {"code": 500}
+
+    async def handler(request):
+        attempts.append(request)
+        if status["code"] == 200:
+            # The probe is still in progress while the other request arrives.
+            await asyncio.sleep(0.05)
+        return httpx.Response(status["code"], json={})
+
+    mock_site(handler)
+
+    async def scenario():
+        for _ in range(2):
+            assert (await HttpTransport.request("GET", URL)).status_code == 500
+        assert Resilience.guard(HttpTransport.pool_key(URL)).breaker.is_open
+        with pytest.raises(FastMCPError, match="not responding"):
+            await HttpTransport.request("GET", URL)
+        assert len(attempts) == 2
+
+        await asyncio.sleep(0.06)
+        status["code"] = 200
+        probe = asyncio.ensure_future(HttpTransport.request("GET", URL))
+        await asyncio.sleep(0.01)
+        with pytest.raises(FastMCPError, match="not responding"):
+            await HttpTransport.request("GET", URL)
+        assert (await probe).status_code == 200
+        assert len(attempts) == 3
+        assert not Resilience.guard(HttpTransport.pool_key(URL)).breaker.is_open
+        assert (await HttpTransport.request("GET", URL)).status_code == 200
+
+    asyncio.run(scenario())
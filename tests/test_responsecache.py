@@ -0,0 +1,78 @@
+import asyncio
+import json
+import httpx
+import pytest
+from urllib.parse import parse_qs
+from moodle_mcp_server.resilience import Resilience
+from moodle_mcp_server.responsecache import ResponseCache
+from moodle_mcp_server.tools import MoodleTool
+from moodle_mcp_server.transport import HttpTransport
+
+BASEURL = "https://moodle.example.com"
+SITE = ("https://moodle.example.com", "fingerprint")
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setenv("MOODLE_RESPONSE_CACHE", "1")
+    cache = ResponseCache()
+    monkeypatch.setattr(MoodleTool, "responseCache", cache)
+    return cache
+
+
+def test_write_invalidates_the_same_component(cache, monkeypatch):
+    monkeypatch.setattr(HttpTransport, "_clients", {})
+    monkeypatch.setattr(Resilience, "_guards", {})
+    calls = []
+
+    def handler(request):
+        name = parse_qs(request.content.decode())["wsfunction"][0]
+        calls.append(name)
+        return httpx.Response(200, json=[{"id": len(calls), "name": name}])
+
+    HttpTransport._clients[HttpTransport.pool_key(BASEURL)] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    async def scenario():
+        call = lambda name: MoodleTool.call_moodle_web_service(BASEURL, "token", name, {"ids": [1]})
+        courses = await call("core_course_get_courses")
+        assert await call("core_course_get_courses") == courses
+        forums = await call("mod_forum_get_forums_by_courses")
+        assert calls == ["core_course_get_courses", "mod_forum_get_forums_by_courses"]
+
+        await call("core_course_update_courses")
+        assert await call("core_course_get_courses") != courses
+        assert await call("mod_forum_get_forums_by_courses") == forums
+        assert calls == ["core_course_get_courses", "mod_forum_get_forums_by_courses",
+                         "core_course_update_courses", "core_course_get_courses"]
+
+    asyncio.run(scenario())
+
+
+def test_size_accounting(cache):
+    cache.max_bytes_per_site = 100
+    other = ("https://other.example.com", "fingerprint")
+    result = ["x" * 30]
+    size = len(json.dumps(result, separators=(",", ":")))
+    cache.put("a", SITE, "core_course_get_courses", result)
+    cache.put("b", SITE, "mod_forum_get_forums_by_courses", result)
+    cache.put("c", other, "core_course_get_courses", result)
+    assert cache.size == 3 * size
+    assert cache.stats()["entries"] == 3
+
+    # Replacing an entry does not count it twice.
+    cache.put("a", SITE, "core_course_get_courses", result)
+    assert cache.size == 3 * size
+
+    cache.invalidate(SITE, "core_course_update_courses")
+    assert cache.get("a") is None and cache.get("b") == result and cache.get("c") == result
+    assert cache.size == 2 * size
+
+    # The oldest entries of the site are evicted when the site exceeds its limit, other sites are not affected.
+    cache.put("d", SITE, "core_user_get_users", result)
+    cache.put("e", SITE, "core_user_get_users_by_field", result)
+    assert cache.get("b") is None and cache.get("c") == result
+    assert cache.size == 3 * size
+
+    cache.forget_site(SITE)
+    cache.forget_site(other)
+    assert cache.size == 0 and cache.stats()["sites"] == 0
@@ -0,0 +1,37 @@
+import asyncio
+import sqlite3
+import threading
+from moodle_mcp_server.middleware import MoodleMiddleware
+from moodle_mcp_server.schemastore import SchemaStore
+
+
+def test_read_errors_leave_the_store_empty(tmp_path):
+    path = str(tmp_path / "schemas.sqlite3")
+    store = SchemaStore(path)
+    store.put_many([("core_x_get_items", "f1", {"name": "core_x_get_items"}), ("upload_files", SchemaStore.EXTRA, {"name": "upload_files"})])
+    assert store.get_many([("core_x_get_items", "f1")]) == {("core_x_get_items", "f1"): {"name": "core_x_get_items"}}
+    with sqlite3.connect(path) as connection:
+        connection.execute("DROP TABLE schemas")
+    assert store.get_many([("core_x_get_items", "f1")]) == {}
+    assert store.get_latest(["core_x_get_items"]) == {}
+    assert store.get_extras() == []
+
+
+def test_store_is_not_used_on_the_event_loop(monkeypatch, tmp_path):
+    monkeypatch.setenv("MOODLE_MCP_CACHE_DIR", str(tmp_path))
+    middleware = MoodleMiddleware()
+    threads = set()
+    for method in ("get_many", "get_extras", "get_latest", "put_many"):
+        original = getattr(middleware._schema_store, method)
+        monkeypatch.setattr(middleware._schema_store, method,
+                            lambda *args, original=original: threads.add(threading.get_ident()) or original(*args))
+
+    async def prepare():
+        stored = {("core_x_get_items", SchemaStore.fingerprint("core_x_get_items")): {"name": "core_x_get_items"}}
+        middleware._schema_store.put_many([(name, fingerprint, definition) for (name, fingerprint), definition in stored.items()])
+        threads.clear()
+        return await middleware._prepare_schemas({"functionnames": ["core_x_get_items"]}, None, None)
+
+    functions, _ = asyncio.run(prepare())
+    assert functions == [{"name": "core_x_get_items"}]
+    assert threads and threading.get_ident() not in threads
@@ -0,0 +1,57 @@
+import asyncio
+import pytest
+from moodle_mcp_server.singleflight import SingleFlight
+
+
+def test_cancelled_caller_does_not_cancel_the_call():
+    flight = SingleFlight()
+    runs = []
+
+    async def fetch():
+        runs.append(1)
+        await asyncio.sleep(0.02)
+        return "result"
+
+    async def scenario():
+        first = asyncio.ensure_future(flight.run("key", fetch))
+        second = asyncio.ensure_future(flight.run("key", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert await second == "result"
+        assert runs == [1]
+        assert flight.stats() == {"inflight": 0, "calls": 1, "coalesced": 1}
+
+    asyncio.run(scenario())
+
+
+def test_call_cancelled_by_all_callers_is_forgotten():
+    flight = SingleFlight()
+
+    async def scenario():
+        caller = asyncio.ensure_future(flight.run("key", lambda: asyncio.sleep(10)))
+        await asyncio.sleep(0)
+        # The call itself is cancelled (for example on shutdown), later callers start a new one.
+        flight._inflight["key"].cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        assert flight.stats()["inflight"] == 0
+        assert await flight.run("key", lambda: asyncio.sleep(0, "again")) == "again"
+
+    asyncio.run(scenario())
+
+
+def test_exception_is_shared():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("failed")
+
+    async def scenario():
+        results = await asyncio.gather(flight.run("key", fail), flight.run("key", fail), return_exceptions=True)
+        assert [type(r) for r in results] == [ValueError, ValueError]
+        assert flight.stats()["calls"] == 1
+
+    asyncio.run(scenario())
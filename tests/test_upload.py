@@ -0,0 +1,65 @@
+import asyncio
+import httpx
+import pytest
+from fastmcp.exceptions import ToolError
+from moodle_mcp_server.tools import MoodleTool
+from moodle_mcp_server.transport import HttpTransport
+from moodle_mcp_server.utils import Utils
+
+
+@pytest.fixture
+def remote(monkeypatch):
+    body = b"x" * 1000
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=body))
+    monkeypatch.setattr(HttpTransport, "_create_client", staticmethod(lambda: httpx.AsyncClient(transport=transport)))
+    monkeypatch.setattr(HttpTransport, "_clients", {})
+    return body
+
+
+def test_fetch_does_not_keep_a_pool(remote):
+    spool = asyncio.run(MoodleTool._fetch_file_from_url("https://files.example.com/a.txt"))
+    spool.seek(0)
+    assert spool.read() == remote
+    assert HttpTransport._clients == {}
+
+
+def test_fetch_size_is_limited(remote, monkeypatch):
+    monkeypatch.setenv("MOODLE_UPLOAD_URL_MAX_BYTES", "999")
+    with pytest.raises(ToolError):
+        asyncio.run(MoodleTool._fetch_file_from_url("https://files.example.com/a.txt"))
+
+
+@pytest.fixture
+def http_mode(monkeypatch):
+    monkeypatch.setenv("MOODLE_MCP_TRANSPORT", "http")
+    monkeypatch.setenv("MOODLE_UPLOAD_ALLOWED_URLS", "https://*.example.com, http://127.0.0.1")
+
+    async def is_public_host(hostname):
+        return hostname.endswith(".example.com")
+
+    monkeypatch.setattr(Utils, "is_public_host", staticmethod(is_public_host))
+
+
+def test_url_upload_is_disabled_without_allowlist(remote, monkeypatch):
+    monkeypatch.setenv("MOODLE_MCP_TRANSPORT", "http")
+    monkeypatch.delenv("MOODLE_UPLOAD_ALLOWED_URLS", raising=False)
+    with pytest.raises(ToolError):
+        asyncio.run(MoodleTool._fetch_file_from_url("https://files.example.com/a.txt"))
+
+
+def test_url_upload_from_internal_address_is_rejected(remote, http_mode):
+    asyncio.run(MoodleTool._fetch_file_from_url("https://files.example.com/a.txt")).close()
+    with pytest.raises(ToolError):
+        asyncio.run(MoodleTool._fetch_file_from_url("http://127.0.0.1/latest/meta-data"))
+
+
+def test_redirect_to_internal_address_is_rejected(monkeypatch, http_mode):
+    def handler(request):
+        if request.url.host == "files.example.com":
+            return httpx.Response(302, headers={"Location": "http://127.0.0.1/secret"})
+        return httpx.Response(200, content=b"secret")
+
+    transport = httpx.MockTransport(handler)
+    monkeypatch.setattr(HttpTransport, "_create_client", staticmethod(lambda: httpx.AsyncClient(transport=transport)))
+    with pytest.raises(ToolError):
+        asyncio.run(MoodleTool._fetch_file_from_url("https://files.example.com/a.txt"))